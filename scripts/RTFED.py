@@ -4,50 +4,19 @@
 # In[ ]:
 
 
-import os
+import sys
 import threading
 import datetime
-import csv
-import gspread
-from google.oauth2.service_account import Credentials
 import tkinter as tk
 from tkinter import ttk, filedialog, messagebox
-import serial
-import serial.tools.list_ports
 import queue
 import time
-import re
 import webbrowser
+from collections import deque
 
-# Column headers for Google Spreadsheet
-column_headers = [
-    "MM/DD/YYYY hh:mm:ss.SSS", "Temp", "Humidity", "Library_Version", "Session_type",
-    "Device_Number", "Battery_Voltage", "Motor_Turns", "FR", "Event", "Active_Poke",
-    "Left_Poke_Count", "Right_Poke_Count", "Pellet_Count", "Block_Pellet_Count",
-    "Retrieval_Time", "InterPelletInterval", "Poke_Time",
-    "PelletsOrTrialToSwitch", "Prob_left", "Prob_right", "High_prob_poke"  
-]
-
-
-# Google Sheets Scope
-SCOPE = [
-    "https://spreadsheets.google.com/feeds",
-    "https://www.googleapis.com/auth/spreadsheets",
-    "https://www.googleapis.com/auth/drive.file",
-    "https://www.googleapis.com/auth/drive"
-]
-
-def trigger_poke(serial_ports):
-    # Sends the TRIGGER_POKE command to each port.
-    for port in serial_ports:
-        try:
-            with serial.Serial(port, baudrate=115200, timeout=1) as ser:
-                ser.write(b'TRIGGER_POKE\n')
-                time.sleep(0.2)
-                response = ser.readline().decode().strip()
-                print(f"Response from {port}: {response}")
-        except Exception as e:
-            print(f"Error sending poke command to {port}: {e}")
+# The acquisition engine lives in rtfed_core, which also runs on its own without Tk:
+#   python rtfed_core.py --config rtfed.json
+from rtfed_core import FED3Monitor, MODE_OPTIONS
 
 # Splash Screen Class
 class SplashScreen:
@@ -67,6 +36,11 @@ class SplashScreen:
             fg="violet"
         )
         self.label_text.place(relx=0.5, rely=0.5, anchor=tk.CENTER)
+        # Any click or key press skips the rest of the splash
+        self.closed = False
+        self.root.bind("<Button-1>", lambda event: self.close())
+        self.root.bind("<Key>", lambda event: self.close())
+        self.root.focus_force()
         self.fade_in_out(duration)
 
     def fade_in_out(self, duration):
@@ -77,6 +51,8 @@ class SplashScreen:
         increment = 1 / (time_ms // 50)
         def fade():
             nonlocal alpha
+            if self.closed:
+                return
             if alpha < 1.0:
                 alpha += increment
                 self.root.attributes("-alpha", alpha)
@@ -90,6 +66,8 @@ class SplashScreen:
         decrement = 1 / (time_ms // 50)
         def fade():
             nonlocal alpha
+            if self.closed:
+                return
             if alpha > 0.0:
                 alpha -= decrement
                 self.root.attributes("-alpha", alpha)
@@ -99,10 +77,309 @@ class SplashScreen:
         fade()
 
     def close(self):
-        self.root.destroy()
+        if not self.closed:
+            self.closed = True
+            self.root.destroy()
+
+
+class TextFeed:
+    """
+    Moves queued messages into a Tk Text widget once per GUI tick. At most max_drain
+    messages are taken per tick and only the newest max_per_tick of them are shown, in a
+    single insert; the skipped ones become a "N messages dropped from view" line. The
+    widget keeps its last max_lines lines, so it neither grows nor slows down over a
+    week-long session.
+    """
+    def __init__(self, widget, max_lines=1000, max_per_tick=200, max_drain=5000):
+        self.widget = widget
+        self.max_lines = max_lines
+        self.max_per_tick = max_per_tick
+        self.max_drain = max_drain
+        self.dropped = 0
+
+    def pump(self, q, intercept=None, prefix=""):
+        # intercept(message) -> True for control messages that are handled, not shown
+        recent = deque(maxlen=self.max_per_tick)
+        shown = 0
+        for _ in range(self.max_drain):
+            try:
+                message = q.get_nowait()
+            except queue.Empty:
+                break
+            if intercept is not None and intercept(message):
+                continue
+            recent.append(message)
+            shown += 1
+        if not recent:
+            return
+        text = "".join(f"{prefix}{message}\n" for message in recent)
+        skipped = shown - len(recent)
+        if skipped:
+            self.dropped += skipped
+            text = f"[{skipped} messages dropped from view]\n" + text
+        widget = self.widget
+        widget.insert(tk.END, text)
+        lines = int(widget.index("end-1c").split(".")[0]) - 1
+        if lines > self.max_lines:
+            widget.delete("1.0", f"{lines - self.max_lines + 1}.0")
+        widget.see(tk.END)
+
+
+class PokeIndicators:
+    """
+    Blinks the poke indicator of every port from one shared Tk timer. A poke lights the
+    port's indicator and (re)arms its blink for `duration` seconds; further pokes only
+    extend it, so a device poking 20 times a second costs the same as one poking once a
+    minute, and there is never more than one after() callback pending for all ports together.
+    paint(port, lit) draws the indicator.
+    """
+    def __init__(self, root, paint, interval=250, duration=1.5):
+        self.root = root
+        self.paint = paint
+        self.interval = interval
+        self.duration = duration
+        self._active = {}  # port -> [blink until, lit]
+        self._running = False
+
+    def poke(self, port):
+        until = time.monotonic() + self.duration
+        entry = self._active.get(port)
+        if entry is not None:
+            entry[0] = until
+            return
+        self.paint(port, True)
+        self._active[port] = [until, True]
+        if not self._running:
+            self._running = True
+            self.root.after(self.interval, self._step)
+
+    def _step(self):
+        now = time.monotonic()
+        for port, entry in list(self._active.items()):
+            until, lit = entry
+            if now >= until:
+                self.paint(port, False)
+                del self._active[port]
+                continue
+            entry[1] = not lit
+            self.paint(port, entry[1])
+        if self._active:
+            self.root.after(self.interval, self._step)
+        else:
+            self._running = False
+
+
+class PortTile:
+    """What a port's tile shows; kept whether or not the tile is on screen."""
+    def __init__(self, port, index, lines=4):
+        self.port = port
+        self.index = index
+        self.title = f"Port {port}"
+        self.status = "Not Ready"
+        self.status_color = "red"
+        self.lines = deque(maxlen=lines)
+        self.selected = True
+        self.lit = False
+        self.dirty = True
+
+
+class DeviceGrid:
+    """
+    Every port as a tile drawn on one shared Canvas: title/summary, status, poke
+    indicator, its latest messages and the Apply Mode checkbox. Canvas items exist only
+    for the tiles in and next to the visible rows and are handed over to the next tiles
+    as the view scrolls, so adding ports, repainting and re-theming cost the same with
+    200 devices as with 2. Status and summaries can be set from any thread; refresh()
+    on the Tk thread draws what changed.
+    """
+    def __init__(self, canvas, columns=2, tile_width=440, tile_height=150, pad=10,
+                 lines_per_tile=4, max_drain=5000):
+        self.canvas = canvas
+        self.columns = columns
+        self.tile_width = tile_width
+        self.tile_height = tile_height
+        self.pad = pad
+        self.lines_per_tile = lines_per_tile
+        self.max_drain = max_drain
+        self.line_chars = (tile_width - 24) // 6
+        self.tiles = {}  # port -> PortTile
+        self._order = []  # tile index -> port
+        self._shown = {}  # port -> canvas items of its tile
+        self._pool = []  # items of tiles scrolled out of view, reused for the next ones
+        self.colors = {"bg": "white", "fg": "black", "text_bg": "white", "text_fg": "black"}
+        self._placeholder = canvas.create_text(pad, pad, anchor="nw", text="Connect your FED3 units!",
+                                               font=("Cascadia Code", 20), fill="red")
+        canvas.configure(width=pad + columns * (tile_width + pad), height=2 * (tile_height + pad) + pad)
+        canvas.bind("<Configure>", lambda e: self.refresh())
+        canvas.tag_bind("tile_check", "<Button-1>", self._toggle_selected)
+
+    def __contains__(self, port):
+        return port in self.tiles
+
+    def add(self, port, ready=False):
+        tile = self.tiles.get(port)
+        if tile is not None:
+            return tile
+        tile = PortTile(port, len(self._order), self.lines_per_tile)
+        if ready:
+            tile.status, tile.status_color = "Ready", "green"
+        self.tiles[port] = tile
+        self._order.append(port)
+        if self._placeholder is not None:
+            self.canvas.delete(self._placeholder)
+            self._placeholder = None
+        rows = -(-len(self._order) // self.columns)
+        self.canvas.configure(scrollregion=(0, 0, self.pad + self.columns * (self.tile_width + self.pad),
+                                            self.pad + rows * (self.tile_height + self.pad)))
+        self.refresh()
+        return tile
+
+    def set_status(self, port, text, color):
+        tile = self.tiles.get(port)
+        if tile is not None and (tile.status, tile.status_color) != (text, color):
+            tile.status, tile.status_color = text, color
+            tile.dirty = True
+
+    def set_title(self, port, text):
+        tile = self.tiles.get(port)
+        if tile is not None and tile.title != text:
+            tile.title = text
+            tile.dirty = True
+
+    def set_lit(self, port, lit):
+        tile = self.tiles.get(port)
+        if tile is None:
+            return
+        tile.lit = lit
+        items = self._shown.get(port)
+        if items is not None:
+            self.canvas.itemconfig(items["dot"], fill="red" if lit else "gray")
+
+    def selected_ports(self):
+        return [port for port, tile in self.tiles.items() if tile.selected]
+
+    def pump(self, port, q, intercept=None):
+        # Only the last lines_per_tile messages are ever shown, so older ones just fall off
+        tile = self.tiles[port]
+        for _ in range(self.max_drain):
+            try:
+                message = q.get_nowait()
+            except queue.Empty:
+                break
+            if intercept is not None and intercept(message):
+                continue
+            tile.lines.append(message)
+            tile.dirty = True
+
+    def yview(self, *args):
+        self.canvas.yview(*args)
+        self.refresh()
+
+    def set_theme(self, bg, fg, text_bg, text_fg):
+        self.colors = {"bg": bg, "fg": fg, "text_bg": text_bg, "text_fg": text_fg}
+        self.canvas.configure(bg=bg)
+        for items in list(self._shown.values()) + self._pool:
+            self._color(items)
+
+    def refresh(self):
+        # Work here is proportional to the tiles on screen, not to the fleet
+        wanted = {self._order[i] for i in self._visible_indices()}
+        for port in [port for port in self._shown if port not in wanted]:
+            items = self._shown.pop(port)
+            for item in items.values():
+                self.canvas.itemconfig(item, state="hidden")
+            self._pool.append(items)
+        for port in wanted:
+            tile = self.tiles[port]
+            items = self._shown.get(port)
+            if items is None:
+                items = self._pool.pop() if self._pool else self._create_items()
+                self._shown[port] = items
+                self._place(tile, items)
+                self._paint(tile, items)
+            elif tile.dirty:
+                self._paint(tile, items)
+
+    def _visible_indices(self):
+        # Rows in view plus one on either side, so a small scroll doesn't show blanks
+        top = self.canvas.canvasy(0)
+        bottom = top + self.canvas.winfo_height()
+        row_height = self.tile_height + self.pad
+        first_row = max(int(top // row_height) - 1, 0)
+        last_row = int(bottom // row_height) + 1
+        return range(first_row * self.columns, min((last_row + 1) * self.columns, len(self._order)))
+
+    def _create_items(self):
+        c = self.canvas
+        items = {
+            "box": c.create_rectangle(0, 0, 0, 0),
+            "title": c.create_text(0, 0, anchor="nw", width=self.tile_width - 40,
+                                   font=("Cascadia Code", 10, "bold")),
+            "status": c.create_text(0, 0, anchor="nw", font=("Cascadia Code", 10, "italic")),
+            "dot": c.create_oval(0, 0, 0, 0, outline=""),
+            "lines_box": c.create_rectangle(0, 0, 0, 0, outline=""),
+            "lines": c.create_text(0, 0, anchor="nw", font=("Cascadia Code", 8)),
+            "check": c.create_rectangle(0, 0, 0, 0, tags=("tile_check",)),
+            "check_mark": c.create_text(0, 0, font=("Cascadia Code", 9, "bold"), tags=("tile_check",)),
+            "check_label": c.create_text(0, 0, anchor="w", text="Apply Mode", font=("Cascadia Code", 10),
+                                         tags=("tile_check",)),
+        }
+        self._color(items)
+        return items
+
+    def _color(self, items):
+        c = self.canvas
+        colors = self.colors
+        c.itemconfig(items["box"], outline=colors["fg"], fill=colors["bg"])
+        c.itemconfig(items["title"], fill=colors["fg"])
+        c.itemconfig(items["lines_box"], fill=colors["text_bg"])
+        c.itemconfig(items["lines"], fill=colors["text_fg"])
+        c.itemconfig(items["check"], outline=colors["fg"])
+        c.itemconfig(items["check_mark"], fill=colors["fg"])
+        c.itemconfig(items["check_label"], fill=colors["fg"])
+
+    def _place(self, tile, items):
+        row, column = divmod(tile.index, self.columns)
+        x0 = self.pad + column * (self.tile_width + self.pad)
+        y0 = self.pad + row * (self.tile_height + self.pad)
+        x1 = x0 + self.tile_width
+        y1 = y0 + self.tile_height
+        c = self.canvas
+        c.coords(items["box"], x0, y0, x1, y1)
+        c.coords(items["title"], x0 + 8, y0 + 6)
+        c.coords(items["dot"], x1 - 20, y0 + 8, x1 - 10, y0 + 18)
+        c.coords(items["status"], x0 + 8, y0 + 40)
+        c.coords(items["lines_box"], x0 + 8, y0 + 60, x1 - 8, y1 - 28)
+        c.coords(items["lines"], x0 + 12, y0 + 62)
+        c.coords(items["check"], x0 + 8, y1 - 22, x0 + 20, y1 - 10)
+        c.coords(items["check_mark"], x0 + 14, y1 - 16)
+        c.coords(items["check_label"], x0 + 26, y1 - 16)
+        for item in items.values():
+            c.itemconfig(item, state="normal")
+
+    def _paint(self, tile, items):
+        c = self.canvas
+        c.itemconfig(items["title"], text=tile.title)
+        c.itemconfig(items["status"], text=tile.status, fill=tile.status_color)
+        c.itemconfig(items["dot"], fill="red" if tile.lit else "gray")
+        c.itemconfig(items["lines"], text="\n".join(line[:self.line_chars] for line in tile.lines))
+        c.itemconfig(items["check_mark"], text="\u2713" if tile.selected else "")
+        tile.dirty = False
+
+    def _toggle_selected(self, event):
+        clicked = self.canvas.find_withtag("current")
+        if not clicked:
+            return
+        for port, items in self._shown.items():
+            if clicked[0] in (items["check"], items["check_mark"], items["check_label"]):
+                tile = self.tiles[port]
+                tile.selected = not tile.selected
+                self._paint(tile, items)
+                return
 
 # Main GUI Application Class
-class FED3MonitorApp:
+class FED3MonitorApp(FED3Monitor):
+    """Tk client of FED3Monitor: the engine's state, shown and driven from one window."""
     def __init__(self, root):
         self.root = root
         self.root.title("RTFED(Windows OS)")
@@ -112,46 +389,23 @@ class FED3MonitorApp:
         self.experiment_name = tk.StringVar()
         self.json_path = tk.StringVar()
         self.spreadsheet_id = tk.StringVar()
-        self.save_path = ""
-        self.data_queue = queue.Queue()
-        self.serial_ports = set(self.detect_serial_ports())
-        self.threads = []
-        self.port_widgets = {}
-        self.port_queues = {}
-        self.port_threads = {}
-        self.identification_threads = {}
-        self.identification_stop_events = {}
-        self.log_queue = queue.Queue()
+        super().__init__()
+        self.hotplug_queue = queue.Queue()
+        self.summary_counts = {}  # port -> (row count, time) at the last summary, for rows/s
+        self.last_summary_time = time.time()
         self.recording_circle = None
         self.recording_label = None
-        self.data_to_save = {}
-        self.stop_event = threading.Event()
-        self.logging_active = False
-        self.data_saved = False
-        self.gspread_client = None
-        self.last_device_check_time = time.time()
-        self.retry_attempts = 5
-        self.retry_delay = 2
-        self.port_to_device_number = {}
-        self.port_to_serial = {}
-        self.time_sync_commands = {}
-        # Internal counter for fallback device numbering (only used if device returns "SIMULATED_POKE")
-        self.next_device_number = 1
+        # Progress table of the running mode change
+        self.mode_table = None
+        # Lines kept in the log view; port tiles keep DeviceGrid.lines_per_tile
+        self.log_view_lines = 5000
 
         self.setup_gui()
+        self.start()
         self.root.after(0, self.update_gui)
         self.root.after(100, self.show_instruction_popup)
-        self.root.after(200, self.start_identification_threads)
         self.root.protocol("WM_DELETE_WINDOW", self.on_closing)
 
-    def detect_serial_ports(self):
-        ports = list(serial.tools.list_ports.comports())
-        fed3_ports = []
-        for port in ports:
-            if port.vid == 0x239A and port.pid == 0x800B:
-                fed3_ports.append(port.device)
-        return fed3_ports
-
     def set_device_mode(self):
         selected = self.mode_var.get()
         if not selected or selected == "Select Mode":
@@ -161,10 +415,7 @@ class FED3MonitorApp:
         mode_num = int(selected.split(" - ")[0])
     
         # only ports whose checkbox is checked
-        ports_to_set = [
-            port for port, widgets in self.port_widgets.items()
-            if widgets['selected_var'].get()
-        ]
+        ports_to_set = self.device_grid.selected_ports()
         if not ports_to_set:
             messagebox.showwarning(
                 "No Ports Selected",
@@ -172,41 +423,42 @@ class FED3MonitorApp:
             )
             return
     
-        for port in ports_to_set:
-            try:
-                with serial.Serial(port, baudrate=115200, timeout=2) as ser:
-                    ser.write(f"SET_MODE:{mode_num}\n".encode('utf-8'))
-                    start_time = time.time()
-                    confirmed = False
-                    while time.time() - start_time < 3:
-                        response = ser.readline().decode().strip()
-                        if response == "MODE_SET_OK":
-                            self.log_queue.put(
-                                f"Mode {mode_num} set on {port}. Device will restart."
-                            )
-                            confirmed = True
-                            break
-                        elif response == "MODE_SET_FAIL":
-                            self.log_queue.put("Mode set failed on {port}.")
-                            confirmed = True
-                            break
-                    if not confirmed:
-                        self.log_queue.put(
-                            f"No confirmation received from {port} when setting mode."
-                        )
-            except Exception as e:
-                self.log_queue.put(f"Error setting mode on {port}: {e}")
-
-
-
-  
-
-
-
-
+        busy = [port for port in ports_to_set if port in self.mode_change_ports]
+        if busy:
+            messagebox.showwarning(
+                "Mode Change Running",
+                "A mode change is still in progress on: " + ", ".join(busy)
+            )
+            return
 
+        self.show_mode_table(selected, ports_to_set)
+        self.change_mode(mode_num, ports_to_set)
+
+    def show_mode_table(self, mode_label, ports):
+        if self.mode_table is not None and self.mode_table.winfo_exists():
+            self.mode_table.winfo_toplevel().destroy()
+        window = tk.Toplevel(self.root)
+        window.title(f"Set Mode: {mode_label}")
+        table = ttk.Treeview(window, columns=("port", "device", "status"), show="headings",
+                             height=min(len(ports), 20))
+        for column, heading, width in (("port", "Port", 120), ("device", "Device", 80), ("status", "Status", 220)):
+            table.heading(column, text=heading)
+            table.column(column, width=width)
+        for port in ports:
+            table.insert("", tk.END, iid=port,
+                         values=(port, self.port_to_device_number.get(port, "unknown"), "Queued"))
+        table.pack(fill=tk.BOTH, expand=True, padx=5, pady=5)
+        self.mode_table = table
 
-    
+    def update_mode_table(self):
+        try:
+            while True:
+                port, status = self.mode_progress_queue.get_nowait()
+                if self.mode_table is not None and self.mode_table.winfo_exists() and self.mode_table.exists(port):
+                    self.mode_table.item(port, values=(
+                        port, self.port_to_device_number.get(port, "unknown"), status))
+        except queue.Empty:
+            pass
 
     def setup_gui(self):
         self.main_frame = tk.Frame(self.root, highlightthickness=0, bd=0)
@@ -261,12 +513,7 @@ class FED3MonitorApp:
         )
         self.identify_devices_button.grid(column=0, row=4, padx=5, pady=5)
         self.mode_var = tk.StringVar(value="Select Mode")
-        self.mode_options = [
-            "0 - Free Feeding", "1 - FR1", "2 - FR3", "3 - FR5",
-            "4 - Progressive Ratio", "5 - Extinction", "6 - Light Tracking",
-            "7 - FR1 (Reversed)", "8 - PR (Reversed)", "9 - Self-Stim",
-            "10 - Self-Stim (Reversed)", "11 - Timed Feeding", "12 - ClosedEconomy_PR2", "13 - Probabilistic Reversal", "14 - Bandit8020", "15 - DetBandit"
-        ]
+        self.mode_options = MODE_OPTIONS
         self.mode_menu = ttk.Combobox(
             self.top_frame, textvariable=self.mode_var,
             values=self.mode_options, width=30, state="readonly"
@@ -291,19 +538,12 @@ class FED3MonitorApp:
         self.ports_frame_container.pack(pady=10, fill=tk.BOTH, expand=True)
         self.ports_canvas = tk.Canvas(self.ports_frame_container, highlightthickness=0, bd=0)
         self.ports_canvas.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
-        ports_scrollbar = ttk.Scrollbar(self.ports_frame_container, orient="vertical", command=self.ports_canvas.yview)
+        # All port tiles are drawn on this one canvas; see DeviceGrid
+        self.device_grid = DeviceGrid(self.ports_canvas)
+        self.poke_indicators = PokeIndicators(self.root, self.device_grid.set_lit)
+        ports_scrollbar = ttk.Scrollbar(self.ports_frame_container, orient="vertical", command=self.device_grid.yview)
         ports_scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
         self.ports_canvas.configure(yscrollcommand=ports_scrollbar.set)
-        self.ports_inner_frame = tk.Frame(self.ports_canvas, highlightthickness=0, bd=0)
-        self.ports_inner_frame.bind("<Configure>", lambda e: self.ports_canvas.configure(scrollregion=self.ports_canvas.bbox("all")))
-        self.ports_canvas.create_window((0, 0), window=self.ports_inner_frame, anchor="nw")
-        self.ports_frame = self.ports_inner_frame
-        if self.serial_ports:
-            for idx, port in enumerate(self.serial_ports):
-                self.initialize_port_widgets(port, idx)
-        else:
-            tk.Label(self.ports_frame, text="Connect your FED3 units and restart RTFED!",
-                     font=("Cascadia Code", 20), fg="red").pack()
         self.indicator_frame = tk.Frame(self.main_frame, highlightthickness=0, bd=0)
         self.indicator_frame.pack(pady=10)
         self.canvas = tk.Canvas(self.indicator_frame, width=100, height=100, highlightthickness=0, bd=0)
@@ -317,6 +557,7 @@ class FED3MonitorApp:
         log_scrollbar = ttk.Scrollbar(self.log_frame, orient="vertical", command=self.log_text.yview)
         log_scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
         self.log_text.configure(yscrollcommand=log_scrollbar.set)
+        self.log_feed = TextFeed(self.log_text, max_lines=self.log_view_lines)
         self.bottom_frame = tk.Frame(self.root, highlightthickness=0, bd=0)
         self.bottom_frame.pack(side=tk.BOTTOM, fill=tk.X)
         self.footer_label = tk.Label(self.bottom_frame, text="© 2025 McCutcheonLab | UiT | Norway",
@@ -332,6 +573,7 @@ class FED3MonitorApp:
         self.hyperlink_label.bind("<Button-1>", lambda e: self.open_hyperlink("https://www.linkedin.com/in/hamid-taghipourbibalan-b7239088/"))
         self.apply_theme()
 
+
     def open_hyperlink(self, URL):
         webbrowser.open_new(URL)
 
@@ -344,53 +586,18 @@ class FED3MonitorApp:
         messagebox.showwarning("Caution", 
             "1) If you need to restart a FED3 during an experiment, do it while the internet connection is active.\n"
             "2) Restart and reconnect FED3 units one at a time if needed.\n"
-            "3) After restarting a device, the data file saved locally would only contain the data logged after restart, however the full length data would remain available on your Google spreadsheet.\n"                  
+            "3) After restarting a device, logging continues in the same local data file and on your Google spreadsheet.\n"                  
             "4) IT IS VERY IMPORTANT to identify FED3 devices before pressing START or else RTFED will not log data.\n"
             "5) We recommend using a powered USB hub if many FED3 units are connected.")
 
-    def initialize_port_widgets(self, port, idx=None):
-        if port in self.port_widgets:
-            return
-        if idx is None:
-            idx = len(self.port_widgets)
-        frame = tk.LabelFrame(self.ports_frame, text=f"Port {port}", highlightthickness=0, bd=1,
-                              font=("Cascadia Code", 10, "bold"))
-        frame.grid(column=idx % 2, row=idx // 2, padx=10, pady=10, sticky=tk.W)
-        status_label = tk.Label(frame, text="Not Ready", font=("Cascadia Code", 10, "italic"),
-                                fg="red", bd=0, highlightthickness=0)
-        status_label.grid(column=0, row=0, sticky=tk.W)
-        text_widget = tk.Text(frame, width=40, height=5, highlightthickness=0, bd=1)
-        text_widget.grid(column=0, row=1, sticky=(tk.N, tk.S, tk.E, tk.W))
-        indicator_canvas = tk.Canvas(frame, width=20, height=20, highlightthickness=0, bd=0)
-        indicator_canvas.grid(column=1, row=0, padx=5)
-        indicator_circle = indicator_canvas.create_oval(5, 5, 15, 15, fill="gray", outline="")
-        self.port_widgets[port] = {
-            'frame': frame,
-            'status_label': status_label,
-            'text_widget': text_widget,
-            'indicator_canvas': indicator_canvas,
-            'indicator_circle': indicator_circle
-        }
-
-        ############################################## NEW: checkbox to let the user select this port for mode changes##################
-        selected_var = tk.BooleanVar(value=True)
-        chk = tk.Checkbutton(frame,
-                             text="Apply Mode",
-                             variable=selected_var,
-                             font=("Cascadia Code", 10))
-        chk.grid(column=0, row=2, sticky=tk.W, pady=(5,0))
-        self.port_widgets[port]['selected_var'] = selected_var
-
-
-        
+    def add_port_tile(self, port, ready=False):
+        # Port tiles are added as the hotplug monitor reports devices
+        self.device_grid.add(port, ready)
         self.port_queues[port] = queue.Queue()
-        try:
-            ser = serial.Serial(port, 115200, timeout=1)
-            ser.close()
-            status_label.config(text="Ready", fg="green")
-        except serial.SerialException as e:
-            status_label.config(text="Not Ready", fg="red")
-            self.log_queue.put(f"Error with port {port}: {e}")
+
+    def set_port_status(self, port, text, color):
+        super().set_port_status(port, text, color)
+        self.device_grid.set_status(port, text, color)
 
     def browse_json(self):
         self.json_path.set(filedialog.askopenfilename(title="Select JSON File"))
@@ -398,149 +605,36 @@ class FED3MonitorApp:
     def browse_folder(self):
         self.save_path = filedialog.askdirectory(title="Select Folder to Save Data")
 
-    def start_identification_threads(self):
-        for port in list(self.serial_ports):
-            self.start_identification_thread(port)
-
-    def start_identification_thread(self, port):
-        if port in self.identification_threads:
-            return
-        stop_event = threading.Event()
-        self.identification_stop_events[port] = stop_event
-        def identification_with_delay():
-            time.sleep(1)
-            self.identification_thread(port, stop_event)
-        t = threading.Thread(target=identification_with_delay)
-        t.daemon = True
-        t.start()
-        self.identification_threads[port] = t
-        self.log_queue.put(f"Started identification thread for {port}.")
-
-    def stop_identification_threads(self):
-        for port, event in list(self.identification_stop_events.items()):
-            event.set()
-        for port, t in list(self.identification_threads.items()):
-            t.join()
-            self.log_queue.put(f"Stopped identification thread for {port}.")
-            del self.identification_threads[port]
-            del self.identification_stop_events[port]
-
-    def identification_thread(self, port, stop_event):
-        event_index = column_headers.index("Event") - 1
-        device_number_index = column_headers.index("Device_Number") - 1
-        device_number_found = None
-        try:
-            ser = serial.Serial(port, 115200, timeout=0.1)
-            while not stop_event.is_set():
-                try:
-                    data = ser.readline().decode('utf-8', errors='replace').strip()
-                    if data:
-                        data_list = data.split(",")[1:]  # Skip first item
-                        if len(data_list) == len(column_headers) - 1:
-                            event_value = data_list[event_index].strip()
-                            dn = data_list[device_number_index].strip()
-                            if event_value in ["Right", "Left", "Pellet", "LeftWithPellet", "RightWithPellet"]:
-                                self.port_queues[port].put("RIGHT_POKE")
-                            if dn:
-                                device_number_found = dn
-                                break
-                except serial.SerialException as e:
-                    self.log_queue.put(f"Device on {port} disconnected during identification: {e}")
-                    break
-                except Exception as e:
-                    self.log_queue.put(f"Error in identification thread for {port}: {e}")
-        except serial.SerialException as e:
-            if "PermissionError" not in str(e):
-                self.log_queue.put(f"Could not open serial port {port} for identification: {e}")
-        except Exception as e:
-            self.log_queue.put(f"Unexpected error in identification thread for {port}: {e}")
-        finally:
-            try:
-                ser.close()
-            except:
-                pass
-        if device_number_found:
-            self.log_queue.put(f"Identified device_number={device_number_found} on port={port}")
-            self.register_device_number(port, device_number_found)
-
-    def register_device_number(self, port, device_number):
-        self.port_to_device_number[port] = device_number
-        if self.logging_active:
-            self.start_logging_for_port(port)
 
     def identify_fed3_devices(self):
         """
-        When the user presses the Identify Devices button, stop any existing identification threads
-        and trigger a poke on all FED3 devices so that they report their device numbers.
+        When the user presses the Identify Devices button, trigger a poke on all FED3
+        devices so that they report their device numbers.
         """
-        self.stop_identification_threads()
         if not self.serial_ports:
             self.log_queue.put("No FED3 devices detected.")
             messagebox.showwarning("Warning", "No FED3 devices detected. Connect devices first!")
             return
-        self.log_queue.put("Identifying devices by triggering a poke on all connected FED3 devices...")
-        threading.Thread(target=self.trigger_poke_for_identification, daemon=True).start()
-
-    def trigger_poke_for_identification(self):
-        active_ports = list(self.serial_ports)
-        if not active_ports:
-            self.log_queue.put("No FED3 devices detected.")
-            return
-        self.log_queue.put("Triggering poke on all connected FED3 devices for identification...")
-        for port in active_ports:
-            try:
-                with serial.Serial(port, baudrate=115200, timeout=1) as ser:
-                    ser.write(b'TRIGGER_POKE\n')
-                    start_time = time.time()
-                    device_number = None
-                    # Wait up to 3 seconds for a valid CSV line to appear
-                    while time.time() - start_time < 3:
-                        line = ser.readline().decode('utf-8', errors='replace').strip()
-                        if line:
-                            self.log_queue.put(f"Received from {port}: {line}")
-                            # Look for a CSV line by checking for commas
-                            if "," in line:
-                                data_list = line.split(",")
-                                # For devices with a temperature sensor the CSV row is expected to be:
-                                # [DateTime, Temp, Humidity, Library_Version, Session_type, Device_Number, ...]
-                                # So the device number should be at index 5.
-                                if len(data_list) >= 6:
-                                    device_number = data_list[5].strip()
-                                    break
-                    if device_number:
-                        self.register_device_number(port, device_number)
-                        self.log_queue.put(f"Identified device_number={device_number} on port={port}")
-                    else:
-                        self.log_queue.put(f"No valid device number received from {port}.")
-            except Exception as e:
-                self.log_queue.put(f"Error sending poke command to {port}: {e}")
-        self.log_queue.put("Identification process complete.")
-
+        self.identify_devices()
 
     def start_logging(self):
-        self.stop_identification_threads()
-        self.stop_event.clear()
-        self.logging_active = True
         if not self.json_path.get() or not self.spreadsheet_id.get():
             messagebox.showerror("Error", "Please provide the JSON file path and Spreadsheet ID.")
             return
-        experimenter_name = re.sub(r'[<>:"/\\|?*]', '_', self.experimenter_name.get().strip().lower())
-        experiment_name = re.sub(r'[<>:"/\\|?*]', '_', self.experiment_name.get().strip().lower())
-        self.experimenter_name.set(experimenter_name)
-        self.experiment_name.set(experiment_name)
+        self.experimenter = self.experimenter_name.get()
+        self.experiment = self.experiment_name.get()
+        self.credentials_file = self.json_path.get()
+        self.spreadsheet_key = self.spreadsheet_id.get()
         try:
-            creds = Credentials.from_service_account_file(self.json_path.get(), scopes=SCOPE)
-            self.gspread_client = gspread.authorize(creds)
-            self.log_queue.put("Connected to Google Sheets!")
+            super().start_logging()
         except Exception as e:
             messagebox.showerror("Error", f"Failed to connect to Google Sheets: {e}")
             return
+        self.experimenter_name.set(self.experimenter)
+        self.experiment_name.set(self.experiment)
         self.disable_input_fields()
         self.canvas.itemconfig(self.recording_circle, fill="yellow")
         self.canvas.itemconfig(self.recording_label, text="Logging...", fill="black")
-        for port in list(self.serial_ports):
-            if port in self.port_to_device_number:
-                self.start_logging_for_port(port)
 
     def disable_input_fields(self):
         self.experimenter_entry.config(state='disabled')
@@ -554,40 +648,8 @@ class FED3MonitorApp:
         self.json_entry.config(state='normal')
         self.spreadsheet_entry.config(state='normal')
 
-    def start_logging_for_port(self, port):
-        if port in self.port_threads:
-            return
-        if port not in self.port_to_device_number:
-            self.log_queue.put(f"Cannot start logging for {port}, no device_number known yet.")
-            return
-        device_number = self.port_to_device_number[port]
-        worksheet_name = f"Device_{device_number}"
-        def attempt_connection(retries=self.retry_attempts, delay=self.retry_delay):
-            for attempt in range(retries):
-                try:
-                    ser = serial.Serial(port, 115200, timeout=0.1)
-                    self.data_to_save[port] = []
-                    self.port_to_serial[port] = ser
-                    t = threading.Thread(
-                        target=self.read_from_port,
-                        args=(ser, worksheet_name, port)
-                    )
-                    t.daemon = True
-                    t.start()
-                    self.port_threads[port] = t
-                    if self.port_widgets[port]['status_label'].cget("text") != "Ready":
-                        self.port_widgets[port]['status_label'].config(text="Ready", fg="green")
-                    self.log_queue.put(f"Started logging from {port} with sheet {worksheet_name}.")
-                    return
-                except serial.SerialException as e:
-                    self.log_queue.put(f"Attempt {attempt+1}: Error with port {port}: {e}")
-                    time.sleep(delay)
-            self.log_queue.put(f"Failed to connect to port {port} after {retries} attempts.")
-        threading.Thread(target=attempt_connection).start()
 
     def stop_logging(self):
-        self.stop_event.set()
-        self.logging_active = False
         self.log_queue.put("Stopping logging...")
         self.canvas.itemconfig(self.recording_circle, fill="red")
         self.canvas.itemconfig(self.recording_label, text="OFF", fill="red")
@@ -595,73 +657,54 @@ class FED3MonitorApp:
         threading.Thread(target=self._join_threads_and_exit).start()
 
     def _join_threads_and_exit(self):
-        for t in list(self.port_threads.values()):
-            t.join()
-        self.log_queue.put("Logging stopped.")
-        self.save_all_data()
-        for port, ser in self.port_to_serial.items():
-            try:
-                if ser.is_open:
-                    ser.close()
-            except:
-                pass
-        self.port_to_serial.clear()
-        self.data_saved = True
+        self.finish_session()
         self.root.after(0, self._finalize_exit)
 
     def _finalize_exit(self):
         messagebox.showinfo("Data Saved", "All data has been saved locally.")
         self.root.after(0, self.root.destroy)
 
-    def save_all_data(self):
-        if not self.save_path:
-            self.log_queue.put("Error: No save path specified.")
-            return
-        current_time = datetime.datetime.now().strftime("%Y_%m_%d_%H_%M_%S")
-        experimenter_name = self.experimenter_name.get().lower().strip()
-        experiment_name = self.experiment_name.get().lower().strip()
-        experimenter_folder = os.path.join(self.save_path, experimenter_name)
-        experiment_folder = os.path.join(experimenter_folder, f"{experiment_name}_{current_time}")
-        os.makedirs(experiment_folder, exist_ok=True)
-        for port, data_rows in self.data_to_save.items():
-            device_number = self.port_to_device_number.get(port, "unknown")
-            safe_port_name = re.sub(r'[<>:"/\\|?*]', '_', os.path.basename(port))
-            filename_user = os.path.join(experiment_folder, f"{safe_port_name}_device_{device_number}_{current_time}.csv")
-            try:
-                with open(filename_user, mode='w', newline='') as file:
-                    writer = csv.writer(file)
-                    writer.writerow(column_headers)
-                    writer.writerows(data_rows)
-                self.log_queue.put(f"Data saved for {port} at {filename_user}.")
-            except Exception as e:
-                self.log_queue.put(f"Failed to save data for {port}: {e}")
+
+    def update_port_summaries(self):
+        now = time.time()
+        for port, store in list(self.row_stores.items()):
+            count = store.appended
+            if not count or port not in self.device_grid:
+                continue
+            last_count, last_time = self.summary_counts.get(port, (count, now))
+            self.summary_counts[port] = (count, now)
+            rate = (count - last_count) / (now - last_time) if now > last_time else 0.0
+            self.device_grid.set_title(port, self.port_summary(port, now, rate))
+
+    def report_stall(self, port, silent_for):
+        super().report_stall(port, silent_for)
+        self.root.after(0, self.root.bell)
 
     def update_gui(self):
         for port_identifier, q in list(self.port_queues.items()):
-            try:
-                while True:
-                    message = q.get_nowait()
-                    if message == "RIGHT_POKE":
-                        self.trigger_indicator(port_identifier)
-                    else:
-                        text_widget = self.port_widgets[port_identifier]['text_widget']
-                        text_widget.insert(tk.END, message + "\n")
-                        text_widget.see(tk.END)
-            except queue.Empty:
-                pass
-        try:
-            while True:
-                log_message = self.log_queue.get_nowait()
-                self.log_text.insert(tk.END, f"{datetime.datetime.now()}: {log_message}\n")
-                self.log_text.see(tk.END)
-        except queue.Empty:
-            pass
+            def intercept(message, port_identifier=port_identifier):
+                if message == "RIGHT_POKE":
+                    self.trigger_indicator(port_identifier)
+                    return True
+                return False
+            self.device_grid.pump(port_identifier, q, intercept)
+        self.log_feed.pump(self.log_queue, prefix=f"{datetime.datetime.now()}: ")
+        self.device_grid.refresh()
+        self.update_mode_table()
+        self.apply_hotplug_events()
         current_time = time.time()
-        if current_time - self.last_device_check_time >= 5:
-            self.check_device_connections()
-            self.last_device_check_time = current_time
+        if current_time - self.last_summary_time >= 1:
+            self.update_port_summaries()
+            self.last_summary_time = current_time
+        self.service(current_time)
         self.root.after(100, self.update_gui)
 
+    def log_pipeline_stats(self):
+        super().log_pipeline_stats()
+        if self.log_feed.dropped:
+            self.log_queue.put(f"GUI: {self.log_feed.dropped} log messages dropped from view so far "
+                               f"(all data is still logged)")
+
     # def check_device_connections(self):
     #     current_ports = set(self.detect_serial_ports())
     #     for port in list(self.serial_ports):
@@ -686,188 +729,48 @@ class FED3MonitorApp:
     #             if self.logging_active and port in self.port_to_device_number:
     #                 self.start_logging_for_port(port)
 
-    # fixig restart- status issue
-    def check_device_connections(self):
-        current_ports = set(self.detect_serial_ports())
-    
-        # Handle disconnected ports
-        for port in list(self.serial_ports):
-            if port not in current_ports:
-                self.serial_ports.remove(port)
-                if port in self.port_widgets:
-                    self.port_widgets[port]['status_label'].config(text="Not Ready", fg="red")
-                self.log_queue.put(f"Device on {port} disconnected.")
-                if port in self.port_threads:
-                    del self.port_threads[port]
-                if port in self.identification_threads:
-                    self.identification_stop_events[port].set()
-                    self.identification_threads[port].join()
-                    del self.identification_threads[port]
-                    del self.identification_stop_events[port]
-    
-        # Handle newly (re)connected ports
-        for port in current_ports:
-            if port not in self.serial_ports:
-                self.serial_ports.add(port)
-                idx = len(self.port_widgets)
-    
-                if port in self.port_widgets:
-                    # Refresh existing widget’s status
-                    try:
-                        ser = serial.Serial(port, 115200, timeout=1)
-                        ser.close()
-                        self.port_widgets[port]['status_label'].config(text="Ready", fg="green")
-                    except serial.SerialException:
-                        self.port_widgets[port]['status_label'].config(text="Not Ready", fg="red")
-                else:
-                    # First‐time initialization
-                    self.initialize_port_widgets(port, idx)
-    
-                # Restart identification and, if active, logging
-                self.start_identification_thread(port)
-                if self.logging_active and port in self.port_to_device_number:
-                    self.start_logging_for_port(port)
-
+    def port_attached(self, port, ready):
+        # Hotplug monitor thread; tiles are created on the Tk thread
+        known = port in self.device_grid
+        self.hotplug_queue.put(("attach", port, ready, known))
+        if known:
+            self.start_port_services(port)
 
+    def port_detached(self, port):
+        self.hotplug_queue.put(("detach", port, False, True))
 
-
-
-    
-
-    def read_from_port(self, ser, worksheet_name, port_identifier):
-        sheet = None
-        cached_data = []
-        send_interval = 5
-        last_send_time = time.time()
-        jam_event_occurred = False
-        event_index = column_headers.index("Event") - 1
-        device_number_index = column_headers.index("Device_Number") - 1
-        device_number = self.port_to_device_number.get(port_identifier, "unknown")
-        try:
-            spreadsheet = self.gspread_client.open_by_key(self.spreadsheet_id.get())
-            sheet = self.get_or_create_worksheet(spreadsheet, worksheet_name)
-        except Exception as e:
-            self.log_queue.put(f"Failed to access sheet {worksheet_name} at start for {port_identifier}: {e}")
-            sheet = None
-        while not self.stop_event.is_set():
-            try:
-                line = ser.readline().decode('utf-8', errors='replace').strip()
-            except serial.SerialException as e:
-                self.log_queue.put(f"Device on {port_identifier} disconnected: {e}")
-                if port_identifier in self.port_widgets:
-                    self.port_widgets[port_identifier]['status_label'].config(text="Not Ready", fg="red")
-                break
-            cmd_info = self.time_sync_commands.get(port_identifier)
-            if cmd_info and cmd_info[0] == 'pending':
-                start_t = cmd_info[1]
-                elapsed = time.time() - start_t
-                if line == "TIME_SET_OK":
-                    self.log_queue.put(f"Time synced for device on {port_identifier}.")
-                    self.time_sync_commands[port_identifier] = ('done', time.time())
-                    continue
-                elif line == "TIME_SET_FAIL":
-                    self.log_queue.put(f"Time sync command sent to {port_identifier}, no confirmation.")
-                    self.time_sync_commands[port_identifier] = ('done', time.time())
-                    continue
-                elif elapsed > 2.0:
-                    self.log_queue.put(f"Time sync command sent to {port_identifier}, no confirmation.")
-                    self.time_sync_commands[port_identifier] = ('done', time.time())
-                if line:
-                    data_list = line.split(",")[1:] if "," in line else []
-                    if len(data_list) >= len(column_headers) - 1:
-                        event_value = data_list[event_index].strip()
-                        row_data = [datetime.datetime.now().strftime("%m/%d/%Y %H:%M:%S.%f")[:-3]] + data_list
-                        cached_data.append(row_data)
-                        if port_identifier in self.port_queues:
-                            self.port_queues[port_identifier].put(f"Data logged: {data_list}")
-                        self.data_to_save.setdefault(port_identifier, []).append(row_data)
-                        if event_value == "JAM":
-                            jam_event_occurred = True
-                        if event_value in ["Right", "Pellet", "Left", "LeftWithPellet", "RightWithPellet"]:
-                            if port_identifier in self.port_queues:
-                                self.port_queues[port_identifier].put("RIGHT_POKE")
-            else:
-                if line:
-                    data_list = line.split(",")[1:] if "," in line else []
-                    if len(data_list) >= len(column_headers) - 1:
-                        event_value = data_list[event_index].strip()
-                        row_data = [datetime.datetime.now().strftime("%m/%d/%Y %H:%M:%S.%f")[:-3]] + data_list
-                        cached_data.append(row_data)
-                        if port_identifier in self.port_queues:
-                            self.port_queues[port_identifier].put(f"Data logged: {data_list}")
-                        self.data_to_save.setdefault(port_identifier, []).append(row_data)
-                        if event_value == "JAM":
-                            jam_event_occurred = True
-                        if event_value in ["Right", "Pellet", "Left", "LeftWithPellet", "RightWithPellet"]:
-                            if port_identifier in self.port_queues:
-                                self.port_queues[port_identifier].put("RIGHT_POKE")
-                    else:
-                        self.log_queue.put(f"Warning: Data length mismatch on {port_identifier}")
-            current_time = time.time()
-            if (current_time - last_send_time >= send_interval) and sheet:
-                if cached_data:
-                    try:
-                        sheet.append_rows(cached_data)
-                        self.log_queue.put(f"Appended {len(cached_data)} rows from {port_identifier} to Google Sheets.")
-                        cached_data.clear()
-                    except Exception as e:
-                        self.log_queue.put(f"Failed to send data to Google Sheets for {port_identifier}: {e}")
-                if jam_event_occurred:
-                    try:
-                        jam_row = [''] * len(column_headers)
-                        jam_row[0] = datetime.datetime.now().strftime("%m/%d/%Y %H:%M:%S.%f")[:-3]
-                        jam_row[column_headers.index("Event")] = "JAM"
-                        jam_row[column_headers.index("Device_Number")] = device_number
-                        sheet.append_row(jam_row)
-                        self.log_queue.put(f"JAM event logged for {port_identifier}")
-                        jam_event_occurred = False
-                    except Exception as e:
-                        self.log_queue.put(f"Failed to send JAM event to Google Sheets for {port_identifier}: {e}")
-                last_send_time = current_time
-            time.sleep(0.1)
-        self.log_queue.put(f"Closed serial port {port_identifier}")
-
-    def get_or_create_worksheet(self, spreadsheet, title):
+    def apply_hotplug_events(self):
         try:
-            return spreadsheet.worksheet(title)
-        except gspread.exceptions.WorksheetNotFound:
-            sheet = spreadsheet.add_worksheet(title=title, rows="1000", cols="20")
-            sheet.append_row(column_headers)
-            return sheet
+            while True:
+                action, port, ready, known = self.hotplug_queue.get_nowait()
+                if port not in self.device_grid:
+                    if action == "detach":
+                        continue
+                    self.add_port_tile(port, ready)
+                elif ready:
+                    self.set_port_status(port, "Ready", "green")
+                elif ready is not None:
+                    self.set_port_status(port, "Not Ready", "red")
+                # Tiles created just now get their port opened and logging started here
+                if action == "attach" and not known and port in self.serial_ports:
+                    self.start_port_services(port)
+        except queue.Empty:
+            pass
 
     def trigger_indicator(self, port_identifier):
-        if port_identifier not in self.port_widgets:
-            return
-        indicator_canvas = self.port_widgets[port_identifier]['indicator_canvas']
-        indicator_circle = self.port_widgets[port_identifier]['indicator_circle']
-        def blink(times):
-            if times > 0:
-                current_color = indicator_canvas.itemcget(indicator_circle, 'fill')
-                next_color = 'red' if current_color == 'gray' else 'gray'
-                indicator_canvas.itemconfig(indicator_circle, fill=next_color)
-                self.root.after(250, lambda: blink(times - 1))
-            else:
-                indicator_canvas.itemconfig(indicator_circle, fill='gray')
-        blink(6)
+        if port_identifier in self.device_grid:
+            self.poke_indicators.poke(port_identifier)
 
     def on_closing(self):
         if not self.data_saved:
-            self.stop_identification_threads()
             self.stop_event.set()
             self.logging_active = False
-            for t in list(self.identification_threads.values()):
-                t.join()
-            for t in list(self.port_threads.values()):
-                t.join()
+            self.reactor.close_all()
+            if self.uploader is not None:
+                self.uploader.stop(timeout=5)
             self.save_all_data()
-            for port, ser in self.port_to_serial.items():
-                try:
-                    if ser.is_open:
-                        ser.close()
-                except:
-                    pass
-            self.port_to_serial.clear()
             self.data_saved = True
+        self.shutdown()
         self.root.destroy()
 
     def toggle_dark_mode(self):
@@ -895,8 +798,8 @@ class FED3MonitorApp:
         self.main_frame.configure(bg=bg_color)
         self.top_frame.configure(bg=bg_color)
         self.ports_frame_container.configure(bg=bg_color)
-        self.ports_canvas.configure(bg=bg_color, highlightthickness=0, bd=0)
-        self.ports_inner_frame.configure(bg=bg_color)
+        self.ports_canvas.configure(highlightthickness=0, bd=0)
+        self.device_grid.set_theme(bg_color, fg_color, text_bg, text_fg)
         self.indicator_frame.configure(bg=bg_color)
         self.log_frame.configure(bg=bg_color)
         self.bottom_frame.configure(bg=bg_color)
@@ -917,59 +820,14 @@ class FED3MonitorApp:
         self.json_entry.configure(bg=entry_bg, fg=entry_fg, insertbackground=entry_fg, highlightthickness=0)
         self.spreadsheet_entry.configure(bg=entry_bg, fg=entry_fg, insertbackground=entry_fg, highlightthickness=0)
         self.log_text.configure(bg=text_bg, fg=text_fg, insertbackground=fg_color, highlightthickness=0)
-        for port, widgets in self.port_widgets.items():
-            frame = widgets['frame']
-            frame.configure(bg=bg_color, fg=fg_color, highlightthickness=0)
-            widgets['status_label'].configure(bg=bg_color, fg=widgets['status_label'].cget("fg"))
-            widgets['text_widget'].configure(bg=text_bg, fg=text_fg, insertbackground=fg_color, highlightthickness=0)
-            widgets['indicator_canvas'].configure(bg=bg_color, highlightthickness=0, bd=0)
         self.canvas.configure(bg=canvas_bg, highlightthickness=0)
 
-    def sync_all_device_times(self):
-        now = datetime.datetime.now()
-        time_str = f"SET_TIME:{now.year},{now.month},{now.day},{now.hour},{now.minute},{now.second}"
-        if self.logging_active:
-            for port, device_number in self.port_to_device_number.items():
-                ser = self.port_to_serial.get(port)
-                if ser and ser.is_open:
-                    self.time_sync_commands[port] = ('pending', time.time())
-                    try:
-                        ser.write((time_str + "\n").encode('utf-8'))
-                    except Exception as e:
-                        self.log_queue.put(f"Failed to sync time for {port}: {e}")
-                else:
-                    self.log_queue.put(f"No open serial connection for {port} to sync.")
-        else:
-            for port in self.port_to_device_number.keys():
-                self.time_sync_commands[port] = ('pending', time.time())
-                try:
-                    ser = serial.Serial(port, 115200, timeout=2)
-                    ser.write((time_str + "\n").encode('utf-8'))
-                    start_t = time.time()
-                    got_response = False
-                    while time.time() - start_t < 2:
-                        line = ser.readline().decode('utf-8', errors='replace').strip()
-                        if line == "TIME_SET_OK":
-                            self.log_queue.put(f"Time synced for device on {port}.")
-                            got_response = True
-                            break
-                        elif line == "TIME_SET_FAIL":
-                            self.log_queue.put(f"Time sync command sent to {port}, no confirmation.")
-                            got_response = True
-                            break
-                    if not got_response:
-                        self.log_queue.put(f"Time sync command sent to {port}, no confirmation.")
-                    ser.close()
-                    self.time_sync_commands[port] = ('done', time.time())
-                except Exception as e:
-                    self.log_queue.put(f"Failed to sync time for {port}: {e}")
-                    self.time_sync_commands[port] = ('done', time.time())
-
 if __name__ == "__main__":
-    splash_root = tk.Tk()
-    SplashScreen(splash_root, duration=7000)
-    splash_root.after(7000, splash_root.destroy)
-    splash_root.mainloop()
+    # The splash screen is opt-in so the window is usable straight away: RTFED.py --splash
+    if "--splash" in sys.argv[1:]:
+        splash_root = tk.Tk()
+        SplashScreen(splash_root, duration=7000)
+        splash_root.mainloop()
 
     root = tk.Tk()
     app = FED3MonitorApp(root)
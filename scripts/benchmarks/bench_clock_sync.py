@@ -0,0 +1,96 @@
+# Clock agreement after a sync: the old sequential SET_TIME loop against ClockSync.
+# Each simulated device has its own symmetric serial latency and sets its clock to the
+# commanded second at the moment the command reaches it (arrival at the pty plus half
+# its latency). The true offset of a device is that second minus the host time it was
+# applied at; the spread of offsets across the fleet is what timed-feeding cohorts see.
+# Usage: python bench_clock_sync.py [--devices 48] [--max-latency 0.04]
+
+import argparse
+import datetime
+import queue
+import random
+import time
+
+import serial
+
+from fed3_sim import CommandResponder, make_fleet
+from rtfed_core import ClockSync, LineFramer, PortChannels
+
+
+def sync_sequential(ports):
+    # The pre-ClockSync loop: one second-resolution string, sent port by port
+    now = datetime.datetime.now()
+    time_str = f"SET_TIME:{now.year},{now.month},{now.day},{now.hour},{now.minute},{now.second}"
+    for port in ports:
+        with serial.Serial(port, 115200, timeout=2) as ser:
+            ser.write((time_str + "\n").encode('utf-8'))
+            framer = LineFramer()
+            start_t = time.time()
+            got_response = False
+            while not got_response and time.time() - start_t < 2:
+                for line in framer.read_lines(ser):
+                    if line in ("TIME_SET_OK", "TIME_SET_FAIL"):
+                        got_response = True
+                        break
+
+
+def sync_clock(ports):
+    log = queue.Queue()
+    with PortChannels(log, ports) as channels:
+        return ClockSync(log).run(channels)
+
+
+def true_offsets(responder, latencies):
+    # Last SET_TIME each device applied, as (commanded second - host time applied)
+    applied = {}
+    for device_number, command, received in responder.received:
+        if command.startswith("SET_TIME:") and command != "SET_TIME:?":
+            fields = [int(v) for v in command.split(":", 1)[1].split(",")]
+            second = datetime.datetime(*fields).timestamp()
+            applied[device_number] = second - (received + latencies[device_number] / 2)
+    return applied
+
+
+def describe(offsets):
+    values = sorted(offsets)
+    return (f"offsets min {values[0] * 1000:+8.1f} ms  max {values[-1] * 1000:+8.1f} ms  "
+            f"spread {(values[-1] - values[0]) * 1000:7.1f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--devices", type=int, default=48)
+    parser.add_argument("--max-latency", type=float, default=0.04, help="largest round trip of a device (s)")
+    args = parser.parse_args()
+    rng = random.Random(1)
+    for name, method in (("sequential", sync_sequential), ("ClockSync", sync_clock)):
+        fleet = make_fleet(args.devices)
+        latencies = {dev.device_number: rng.uniform(0.002, args.max_latency) for dev in fleet}
+
+        def handler(dev, command):
+            if command == "SET_TIME:?":
+                return [(latencies[dev.device_number], "TIME_SET_FAIL\r\n")]
+            if command.startswith("SET_TIME:"):
+                return [(latencies[dev.device_number], "TIME_SET_OK\r\n")]
+            return None
+
+        responder = CommandResponder(fleet, handler)
+        ports = [dev.path for dev in fleet]
+        by_port = {dev.path: dev.device_number for dev in fleet}
+        try:
+            start = time.perf_counter()
+            estimates = method(ports)
+            elapsed = time.perf_counter() - start
+            actual = true_offsets(responder, latencies)
+            print(f"{name:10s} {elapsed:5.2f} s  true {describe(actual.values())}")
+            if estimates:
+                errors = [estimates[port] - actual[by_port[port]] for port in estimates]
+                print(f"{'':10s} estimate error max {max(abs(e) for e in errors) * 1000:.1f} ms")
+        finally:
+            responder.close()
+            for dev in fleet:
+                dev.close()
+
+
+if __name__ == "__main__":
+    main()
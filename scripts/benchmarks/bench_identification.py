@@ -0,0 +1,75 @@
+# Wall-clock time to identify a fleet: the old port-by-port TRIGGER_POKE loop against
+# FleetQuery. Simulated devices answer the poke with a FED3 row after a random delay,
+# and one of them is slow.
+# Usage: python bench_identification.py [--devices 48] [--max-delay 1.0] [--slow 2.5]
+
+import argparse
+import queue
+import random
+import time
+
+import serial
+
+from fed3_sim import CommandResponder, fed3_line, make_fleet
+from rtfed_core import FED3Parser, FleetQuery, LineFramer
+
+
+def identify_sequential(ports):
+    parser = FED3Parser()
+    found = {}
+    for port in ports:
+        with serial.Serial(port, baudrate=115200, timeout=1) as ser:
+            ser.write(b'TRIGGER_POKE\n')
+            framer = LineFramer()
+            start_time = time.time()
+            while port not in found and time.time() - start_time < 3:
+                for line in framer.read_lines(ser):
+                    record = parser.parse(line)
+                    if record is not None and record.device_number:
+                        found[port] = record.device_number
+                        break
+    return found
+
+
+def identify_fleet(ports):
+    parser = FED3Parser()
+
+    def match(port, line):
+        record = parser.parse(line)
+        return record.device_number if record is not None and record.device_number else None
+
+    replies = FleetQuery(queue.Queue(), b'TRIGGER_POKE\n', match, timeout=3.0).run(ports)
+    return {port: device_number for port, (device_number, _) in replies.items()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--devices", type=int, default=48)
+    parser.add_argument("--max-delay", type=float, default=1.0, help="slowest reply of a normal device (s)")
+    parser.add_argument("--slow", type=float, default=2.5, help="reply delay of the one slow device (s)")
+    args = parser.parse_args()
+    fleet = make_fleet(args.devices)
+    rng = random.Random(1)
+    delays = {dev.device_number: rng.uniform(0.05, args.max_delay) for dev in fleet}
+    delays[fleet[-1].device_number] = args.slow
+
+    def handler(dev, command):
+        if command == "TRIGGER_POKE":
+            return [(delays[dev.device_number], fed3_line(dev.device_number, "Right"))]
+        return None
+
+    responder = CommandResponder(fleet, handler)
+    ports = [dev.path for dev in fleet]
+    try:
+        for name, method in (("port by port", identify_sequential), ("FleetQuery", identify_fleet)):
+            start = time.perf_counter()
+            found = method(ports)
+            print(f"{name:13s} identified {len(found)}/{len(ports)} in {time.perf_counter() - start:6.2f} s")
+    finally:
+        responder.close()
+        for dev in fleet:
+            dev.close()
+
+
+if __name__ == "__main__":
+    main()
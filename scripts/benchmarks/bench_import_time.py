@@ -0,0 +1,77 @@
+# Import-time profile of RTFED: what each entry point costs before it can do anything.
+# Imports every target in a fresh interpreter with -X importtime, several times, and
+# reports the fastest run's wall time and total import time, plus the slowest packages.
+# "sheets" is the extra cost paid when START first connects to Google Sheets.
+# Usage: python bench_import_time.py [--runs 5] [--top 8]
+
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+SCRIPTS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+TARGETS = {
+    "rtfed_core": "import rtfed_core",
+    "RTFED (Tk)": "import RTFED",
+    "sheets": "import rtfed_core, gspread, google.oauth2.service_account",
+}
+
+
+def profile(code):
+    # Returns (wall s, {module: cumulative us}, top-level modules) for one fresh interpreter
+    start = time.perf_counter()
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", code], cwd=SCRIPTS,
+                            capture_output=True, text=True)
+    wall = time.perf_counter() - start
+    if result.returncode:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1])
+    cumulative, top_level = {}, []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative_us, name = line.split("|")
+        module = name.strip()
+        cumulative[module] = int(cumulative_us)
+        # Nesting is shown by indentation; one space means the import came from the code itself
+        if len(name) - len(name.lstrip()) == 1:
+            top_level.append(module)
+    return wall, cumulative, top_level
+
+
+def best_of(code, runs):
+    return min((profile(code) for _ in range(runs)), key=lambda run: run[0])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=8, help="slowest packages listed per target")
+    args = parser.parse_args()
+    if os.environ.get("PYTHONDONTWRITEBYTECODE"):
+        print("note: PYTHONDONTWRITEBYTECODE is set, so sources without a current .pyc are compiled every run")
+    # Interpreter startup (site, encodings, ...) is measured once and left out below
+    base_wall, startup, _ = best_of("pass", args.runs)
+    print(f"{'startup':12s} wall {base_wall * 1000:6.0f} ms")
+    for name, code in TARGETS.items():
+        try:
+            wall, cumulative, top_level = best_of(code, args.runs)
+        except RuntimeError as e:
+            print(f"{name:12s} failed: {e}")
+            continue
+        total = sum(cumulative[module] for module in top_level if module not in startup)
+        print(f"{name:12s} wall {wall * 1000:6.0f} ms  imports {total / 1000:6.1f} ms  "
+              f"google libraries loaded: {'gspread' in cumulative}")
+        # Heaviest packages, each counted once at its outermost import
+        packages = {}
+        for module, us in cumulative.items():
+            package = module.split(".")[0]
+            if module not in startup and package not in ("rtfed_core", "RTFED"):
+                packages[package] = max(packages.get(package, 0), us)
+        for package in sorted(packages, key=packages.get, reverse=True)[:args.top]:
+            print(f"{'':12s} {packages[package] / 1000:8.1f} ms  {package}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+# Microbenchmark: pyserial readline() against LineFramer bulk reads.
+# Each round queues a burst of FED3 rows on every simulated device, then drains all of
+# them with one method; only the draining is timed.
+# Usage: python bench_line_framer.py [--devices 48] [--rounds 10] [--burst 30]
+
+import argparse
+import time
+
+import serial
+
+from fed3_sim import fed3_line, make_fleet
+from rtfed_core import LineFramer
+
+
+def drain_readline(handles, expected):
+    got = 0
+    for ser, _ in handles:
+        for _ in range(expected):
+            if ser.readline().decode('utf-8', errors='replace').strip():
+                got += 1
+    return got
+
+
+def drain_framer(handles, expected):
+    got = 0
+    for ser, framer in handles:
+        count = 0
+        while count < expected:
+            count += len(framer.read_lines(ser))
+        got += count
+    return got
+
+
+def bench(method, devices, rounds, burst):
+    fleet = make_fleet(devices)
+    handles = [(serial.Serial(dev.path, 115200, timeout=1), LineFramer()) for dev in fleet]
+    payloads = ["".join(fed3_line(dev.device_number) for _ in range(burst)) for dev in fleet]
+    wall = cpu = 0.0
+    lines = 0
+    for _ in range(rounds):
+        for dev, payload in zip(fleet, payloads):
+            dev.write(payload)
+        time.sleep(0.01)
+        wall_start, cpu_start = time.perf_counter(), time.process_time()
+        lines += method(handles, burst)
+        wall += time.perf_counter() - wall_start
+        cpu += time.process_time() - cpu_start
+    for (ser, _), dev in zip(handles, fleet):
+        ser.close()
+        dev.close()
+    return f"{lines} lines  cpu={cpu * 1e3:8.1f} ms  wall={wall * 1e3:8.1f} ms  {cpu / lines * 1e6:6.2f} us/line"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--devices", type=int, default=48)
+    parser.add_argument("--rounds", type=int, default=10)
+    parser.add_argument("--burst", type=int, default=30, help="rows queued per device per round")
+    args = parser.parse_args()
+    for name, method in (("readline()", drain_readline), ("LineFramer", drain_framer)):
+        print(f"{args.devices} devices {name:11s} {bench(method, args.devices, args.rounds, args.burst)}")
+
+
+if __name__ == "__main__":
+    main()
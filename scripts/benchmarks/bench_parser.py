@@ -0,0 +1,73 @@
+# Microbenchmark: the old split-and-index parsing against FED3Parser.
+# Runs both over the same mix of firmware-shaped FED3 rows (NaN, Timed_out and empty
+# bandit cells included) and firmware chatter and reports lines/s.
+# The old path only checked the field count and pulled Event/Device_Number as text;
+# FED3Parser also converts every column to its type.
+# Usage: python bench_parser.py [--lines 200000] [--chatter 0.1]
+
+import argparse
+import random
+import time
+
+from fed3_sim import firmware_fields
+from rtfed_core import FED3Parser, column_headers
+
+CHATTER = [
+    "Unixtime: 1718539200",
+    ">> Bandit probs swapped",
+    "TIME_SET_OK",
+    "MODE_SET_OK",
+]
+
+
+def parse_split_index(lines):
+    event_index = column_headers.index("Event") - 1
+    device_number_index = column_headers.index("Device_Number") - 1
+    rows = 0
+    for line in lines:
+        data_list = line.split(",")[1:] if "," in line else []
+        if len(data_list) >= len(column_headers) - 1:
+            event_value = data_list[event_index].strip()
+            device_number = data_list[device_number_index].strip()
+            if event_value and device_number:
+                rows += 1
+    return rows
+
+
+def parse_schema(lines):
+    parser = FED3Parser()
+    rows = 0
+    for line in lines:
+        record = parser.parse(line)
+        if record is not None and record.event and record.device_number:
+            rows += 1
+    return rows
+
+
+def make_lines(count, chatter):
+    rng = random.Random(1)
+    lines = []
+    for i in range(count):
+        if rng.random() < chatter:
+            lines.append(rng.choice(CHATTER))
+        else:
+            lines.append(",".join(firmware_fields(i, i % 48 + 1)))
+    return lines
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--lines", type=int, default=200000)
+    parser.add_argument("--chatter", type=float, default=0.1, help="fraction of non-CSV lines")
+    args = parser.parse_args()
+    lines = make_lines(args.lines, args.chatter)
+    for name, method in (("split + index", parse_split_index), ("FED3Parser", parse_schema)):
+        start = time.perf_counter()
+        rows = method(lines)
+        elapsed = time.perf_counter() - start
+        print(f"{name:14s} {rows} rows  {args.lines / elapsed / 1e3:8.1f} k lines/s  "
+              f"{elapsed / args.lines * 1e6:5.2f} us/line")
+
+
+if __name__ == "__main__":
+    main()
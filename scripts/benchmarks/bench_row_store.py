@@ -0,0 +1,64 @@
+# Memory benchmark: session rows as lists of str (the old data_to_save/cached_data layout)
+# against DeviceRowStore, on rows shaped like the firmware prints them (NaN, Timed_out and
+# empty bandit cells included, see fed3_sim.firmware_fields).
+# Usage: python bench_row_store.py [--events 1000000] [--baseline-events N]
+
+import argparse
+import gc
+import time
+import tracemalloc
+
+from fed3_sim import firmware_fields
+from rtfed_core import DeviceRowStore, format_host_time
+
+
+def fed3_fields(i):
+    # The data columns of the i-th firmware row; the device date is replaced by host time
+    return ",".join(firmware_fields(i)).split(",")[1:]
+
+
+def measure(label, events, build):
+    gc.collect()
+    tracemalloc.start()
+    started = time.perf_counter()
+    keep = build(events)
+    elapsed = time.perf_counter() - started
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{label:14s} {events:>9d} events  {current / 2 ** 20:8.1f} MiB  "
+          f"{current / events:7.1f} B/event  build {elapsed:5.1f} s")
+    return keep
+
+
+def build_lists(events):
+    base = time.time()
+    # split() output, one fresh list of str per row, as read_from_port built it
+    return [[format_host_time(base + i)] + fed3_fields(i) for i in range(events)]
+
+
+def build_store(events):
+    base = time.time()
+    # Unbounded here, so every event stays in memory like the lists do
+    store = DeviceRowStore(max_rows=events)
+    for i in range(events):
+        store.append(base + i, fed3_fields(i))
+    return store
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--events", type=int, default=1000000)
+    parser.add_argument("--baseline-events", type=int, default=None,
+                        help="events for the list-of-str baseline (default: same as --events)")
+    args = parser.parse_args()
+    baseline = measure("list of str", args.baseline_events or args.events, build_lists)
+    del baseline
+    store = measure("DeviceRowStore", args.events, build_store)
+    # Every cell round-trips to the firmware's text without the overflow map
+    for row in range(0, len(store), max(1, len(store) // 1000)):
+        assert store.row(row)[1:] == fed3_fields(row)
+    print(f"{'':14s} overflow cells {len(store._overflow)}, typed arrays {store.nbytes() / len(store):.1f} B/event")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+# Compares the old one-thread-per-port read loop with the single SerialReactor thread.
+# Usage: python bench_serial_reactor.py [devices ...] [--rate LINES_PER_SEC] [--seconds N]
+
+import argparse
+import queue
+import threading
+import time
+
+import serial
+
+from fed3_sim import LatencySink, make_fleet
+from rtfed_core import SerialReactor
+
+
+class CountingPipeline:
+    def __init__(self, port, sink):
+        self.port = port
+        self.sink = sink
+
+    def handle_open(self, ser):
+        pass
+
+    def handle_disconnect(self, error):
+        pass
+
+    def handle_line(self, line, arrival):
+        self.sink.record(line)
+
+    def tick(self, now):
+        pass
+
+
+def run_per_thread(fleet, sink, stop):
+    # The pre-reactor model: readline() with timeout=0.1 followed by sleep(0.1), one thread each.
+    failures = []
+    def loop(path):
+        ser = serial.Serial(path, 115200, timeout=0.1)
+        try:
+            while not stop.is_set():
+                line = ser.readline().decode('utf-8', errors='replace').strip()
+                if line:
+                    sink.record(line)
+                time.sleep(0.1)
+        except (serial.SerialException, ValueError) as e:
+            # pyserial's select() based readline() cannot handle fd >= 1024 on POSIX
+            failures.append(e)
+        finally:
+            ser.close()
+    threads = [threading.Thread(target=loop, args=(dev.path,), daemon=True) for dev in fleet]
+    for t in threads:
+        t.start()
+    def finish():
+        for t in threads:
+            t.join()
+        if failures:
+            print(f"  per-thread model: {len(failures)} reader threads died: {failures[0]!r}")
+    return finish
+
+
+def run_reactor(fleet, sink, stop):
+    reactor = SerialReactor(queue.Queue())
+    reactor.start()
+    for dev in fleet:
+        reactor.open_port(dev.path, CountingPipeline(dev.path, sink))
+    def finish():
+        reactor.close_all()
+        reactor.stop()
+    return finish
+
+
+def bench(model, devices, rate, seconds):
+    fleet = make_fleet(devices)
+    sink = LatencySink()
+    stop = threading.Event()
+    baseline_threads = threading.active_count()
+    finish = model(fleet, sink, stop)
+    time.sleep(0.5)
+    cpu_start = time.process_time()
+    interval = 1.0 / rate
+    next_send = time.monotonic()
+    end = next_send + seconds
+    peak_threads = 0
+    while time.monotonic() < end:
+        for dev in fleet:
+            dev.write_event()
+        peak_threads = max(peak_threads, threading.active_count() - baseline_threads)
+        next_send += interval
+        time.sleep(max(0.0, next_send - time.monotonic()))
+    time.sleep(0.5)
+    cpu = time.process_time() - cpu_start
+    stop.set()
+    finish()
+    for dev in fleet:
+        dev.close()
+    expected = devices * int(seconds * rate)
+    return f"threads={peak_threads:4d} cpu={cpu:6.2f}s delivered={len(sink.latencies)}/{expected} {sink.summary()}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("devices", nargs="*", type=int, default=[48, 200])
+    parser.add_argument("--rate", type=float, default=5.0, help="lines per second per device")
+    parser.add_argument("--seconds", type=float, default=10.0)
+    args = parser.parse_args()
+    for devices in args.devices:
+        for name, model in (("per-thread", run_per_thread), ("reactor", run_reactor)):
+            print(f"{devices:4d} devices {name:10s} {bench(model, devices, args.rate, args.seconds)}")
+
+
+if __name__ == "__main__":
+    main()
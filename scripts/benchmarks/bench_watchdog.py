@@ -0,0 +1,51 @@
+# Cost of one stall check as the fleet grows: a scan over every port's last-byte time
+# against StallWatchdog.due(), which only looks at the oldest entries.
+# Every port is heard from each round, so nothing is ever due (the normal case).
+# Usage: python bench_watchdog.py [--ports 10 100 1000 10000] [--rounds 2000]
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from rtfed_core import StallWatchdog
+
+
+def scan_all(last_heard, now, quiet_timeout):
+    return [port for port, last in last_heard.items() if now - last >= quiet_timeout]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--ports", type=int, nargs="+", default=[10, 100, 1000, 10000])
+    parser.add_argument("--rounds", type=int, default=2000)
+    args = parser.parse_args()
+    for count in args.ports:
+        ports = [f"/dev/ttyACM{i}" for i in range(count)]
+        watchdog = StallWatchdog(quiet_timeout=300, probe_timeout=10)
+        last_heard = {}
+        now = time.time()
+        for port in ports:
+            watchdog.heard(port, now)
+            last_heard[port] = now
+        scan_time = due_time = 0.0
+        for i in range(args.rounds):
+            # One port reports per round, as on a busy reactor tick
+            port = ports[i % count]
+            now += 0.01
+            watchdog.heard(port, now)
+            last_heard[port] = now
+            start = time.perf_counter()
+            scan_all(last_heard, now, watchdog.quiet_timeout)
+            scan_time += time.perf_counter() - start
+            start = time.perf_counter()
+            watchdog.due(now)
+            due_time += time.perf_counter() - start
+        print(f"{count:6d} ports  full scan {scan_time / args.rounds * 1e6:9.2f} us/tick  "
+              f"StallWatchdog {due_time / args.rounds * 1e6:6.2f} us/tick")
+
+
+if __name__ == "__main__":
+    main()
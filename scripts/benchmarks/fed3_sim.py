@@ -0,0 +1,148 @@
+# Helpers shared by the RTFED benchmarks: simulated FED3 units on pseudo terminals.
+# Linux/macOS only, since Windows has no pty; the per-port read path is the same one
+# RTFED uses on real USB serial ports.
+
+import heapq
+import os
+import selectors
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+
+def fed3_line(device_number=1, event="Right", stamp=None):
+    # A FED3 CSV row as printed by the RTT firmware; the first field carries a
+    # host time_ns stamp so the benchmarks can measure delivery latency.
+    if stamp is None:
+        stamp = time.monotonic_ns()
+    fields = [
+        str(stamp), "22.51", "41.20", "1.17.3", "FR1", str(device_number), "4.12", "0",
+        "1", event, "Left", "10", "12", "8", "0", "1.24", "33.50", "0.12", "0", "0", "0", "0",
+    ]
+    return ",".join(fields) + "\r\n"
+
+
+FIRMWARE_EVENTS = ("Right", "Left", "Pellet", "Right", "LeftWithPellet", "Pellet")
+
+
+def firmware_fields(i, device_number=3):
+    # The fields of the i-th row of a non-bandit session (device date first), shaped
+    # like RTFED_RTT525 prints them: NaN where a column does not apply to the event,
+    # Timed_out for slow retrievals, four empty bandit columns, and counters that move
+    # every event.
+    event = FIRMWARE_EVENTS[i % len(FIRMWARE_EVENTS)]
+    pellet = event == "Pellet"
+    pellets = i // 3
+    return [
+        f"10/18/2026 {i // 3600 % 24:02d}:{i // 60 % 60:02d}:{i % 60:02d}", "22.51", "41.20",
+        "1.17.3", "FR1", str(device_number), f"{4.2 - (i % 50) / 100:.2f}",
+        str(1 + i % 3) if pellet else "NaN", "1", event, "Left",
+        str(i // 2), str(i // 5), str(pellets), str(pellets % 10),
+        ("Timed_out" if i % 7 == 0 else f"{(i % 700) / 100:.2f}") if pellet else "NaN",
+        str(i % 900) if pellet and pellets >= 2 else "NaN",
+        "NaN" if pellet else f"{(i % 90) / 100:.2f}",
+        "", "", "", "",
+    ]
+
+
+class SimulatedFED3:
+    """One pseudo terminal pair; RTFED opens `path` exactly like a FED3 COM port."""
+    def __init__(self, device_number):
+        self.device_number = device_number
+        self.master, self.slave = os.openpty()
+        self.path = os.ttyname(self.slave)
+
+    def write(self, data):
+        os.write(self.master, data.encode() if isinstance(data, str) else data)
+
+    def write_event(self, event="Right"):
+        self.write(fed3_line(self.device_number, event))
+
+    def close(self):
+        for fd in (self.master, self.slave):
+            try:
+                os.close(fd)
+            except OSError:
+                pass
+
+
+class CommandResponder:
+    """
+    Plays the firmware side of the command protocol for a fleet: every command line a
+    device receives is passed to handler(device, command), which returns a list of
+    (delay_s, text) replies to write back after the given delays (or None to stay quiet).
+    """
+    def __init__(self, fleet, handler):
+        self.handler = handler
+        self.received = []  # (device_number, command, time.time() on arrival)
+        self._selector = selectors.DefaultSelector()
+        self._buffers = {}
+        for dev in fleet:
+            self._selector.register(dev.master, selectors.EVENT_READ, dev)
+            self._buffers[dev.master] = b""
+        self._scheduled = []
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        count = 0
+        while not self._stop.is_set():
+            now = time.monotonic()
+            while self._scheduled and self._scheduled[0][0] <= now:
+                _, _, dev, text = heapq.heappop(self._scheduled)
+                try:
+                    dev.write(text)
+                except OSError:
+                    pass
+            timeout = 0.05 if not self._scheduled else max(0.0, min(0.05, self._scheduled[0][0] - now))
+            for key, _ in self._selector.select(timeout):
+                dev = key.data
+                try:
+                    data = os.read(dev.master, 4096)
+                except OSError:
+                    self._selector.unregister(dev.master)
+                    continue
+                buffer = self._buffers[dev.master] + data
+                *lines, self._buffers[dev.master] = buffer.split(b"\n")
+                for raw in lines:
+                    command = raw.decode(errors="replace").strip()
+                    if not command:
+                        continue
+                    self.received.append((dev.device_number, command, time.time()))
+                    received = time.monotonic()
+                    for delay, text in self.handler(dev, command) or ():
+                        count += 1
+                        heapq.heappush(self._scheduled, (received + delay, count, dev, text))
+
+    def close(self):
+        self._stop.set()
+        self._thread.join()
+        self._selector.close()
+
+
+def make_fleet(count):
+    return [SimulatedFED3(i + 1) for i in range(count)]
+
+
+class LatencySink:
+    """Collects arrival latency from the stamp embedded by fed3_line()."""
+    def __init__(self):
+        self.latencies = []
+
+    def record(self, line):
+        try:
+            stamp = int(line.split(",", 1)[0])
+        except ValueError:
+            return
+        self.latencies.append((time.monotonic_ns() - stamp) / 1e6)
+
+    def summary(self):
+        if not self.latencies:
+            return "no lines"
+        values = sorted(self.latencies)
+        p50 = values[len(values) // 2]
+        p99 = values[min(len(values) - 1, int(len(values) * 0.99))]
+        return f"{len(values)} lines, latency p50={p50:.1f} ms p99={p99:.1f} ms"
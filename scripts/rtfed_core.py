@@ -0,0 +1,2620 @@
+"""
+RTFED acquisition core: FED3 hotplug, serial I/O, parsing, local journals and Google
+Sheets upload, with no GUI. RTFED.py is the Tk client of this module; run this file
+directly to log headless (e.g. on a rack server or as a systemd service):
+
+    python rtfed_core.py --config rtfed.json
+"""
+import os
+import threading
+import datetime
+import csv
+import serial
+import serial.tools.list_ports
+import queue
+import time
+import re
+import selectors
+import random
+import io
+import shutil
+import json
+import functools
+from concurrent.futures import Future, wait as wait_futures
+import math
+import enum
+try:
+    import pyudev  # Linux only; without it hotplug falls back to polling
+except ImportError:
+    pyudev = None
+from array import array
+from collections import namedtuple, OrderedDict
+import argparse
+import signal
+import sys
+
+# Column headers for Google Spreadsheet
+column_headers = [
+    "MM/DD/YYYY hh:mm:ss.SSS", "Temp", "Humidity", "Library_Version", "Session_type",
+    "Device_Number", "Battery_Voltage", "Motor_Turns", "FR", "Event", "Active_Poke",
+    "Left_Poke_Count", "Right_Poke_Count", "Pellet_Count", "Block_Pellet_Count",
+    "Retrieval_Time", "InterPelletInterval", "Poke_Time",
+    "PelletsOrTrialToSwitch", "Prob_left", "Prob_right", "High_prob_poke"  
+]
+
+# Typed FED3 columns; every other data column is text
+FLOAT_COLUMNS = ("Temp", "Humidity", "Battery_Voltage", "Retrieval_Time",
+                 "InterPelletInterval", "Poke_Time", "Prob_left", "Prob_right")
+INT_COLUMNS = ("Motor_Turns", "Left_Poke_Count", "Right_Poke_Count", "Pellet_Count",
+               "Block_Pellet_Count", "PelletsOrTrialToSwitch")
+
+
+# Upload outboxes and session journals live outside the data folder so an interrupted
+# session can be resumed or recovered on the next start
+RTFED_HOME = os.path.join(os.path.expanduser("~"), ".rtfed")
+
+# Google Sheets Scope
+SCOPE = [
+    "https://spreadsheets.google.com/feeds",
+    "https://www.googleapis.com/auth/spreadsheets",
+    "https://www.googleapis.com/auth/drive.file",
+    "https://www.googleapis.com/auth/drive"
+]
+
+# FED3 modes selectable with SET_MODE:<n>, in firmware order
+MODE_OPTIONS = [
+    "0 - Free Feeding", "1 - FR1", "2 - FR3", "3 - FR5",
+    "4 - Progressive Ratio", "5 - Extinction", "6 - Light Tracking",
+    "7 - FR1 (Reversed)", "8 - PR (Reversed)", "9 - Self-Stim",
+    "10 - Self-Stim (Reversed)", "11 - Timed Feeding", "12 - ClosedEconomy_PR2", "13 - Probabilistic Reversal", "14 - Bandit8020", "15 - DetBandit"
+]
+
+def format_host_time(timestamp):
+    # Host time column format used for CSV files and Google Sheets rows
+    return datetime.datetime.fromtimestamp(timestamp).strftime("%m/%d/%Y %H:%M:%S.%f")[:-3]
+
+# Serial I/O Engine
+FED3_USB_IDS = (0x239A, 0x800B)
+
+def is_fed3_port(port_info):
+    return (port_info.vid, port_info.pid) == FED3_USB_IDS
+
+def probe_port(port):
+    # Open and close a port to see whether it is usable; returns (ready, error)
+    try:
+        serial.Serial(port, 115200, timeout=1).close()
+        return True, None
+    except serial.SerialException as e:
+        return False, e
+
+
+class HotplugMonitor:
+    """
+    Watches FED3 serial ports come and go on its own thread and calls on_attach(port) /
+    on_detach(port) from that thread; ports already present at start are reported as
+    attached. serial_number(port) gives the USB serial number of an attached port. On
+    Linux with pyudev it blocks on udev tty events, so changes arrive within
+    milliseconds; otherwise (Windows, macOS, or no udev access) it diffs comports() every
+    poll_interval.
+    """
+    def __init__(self, log_queue, on_attach, on_detach, poll_interval=0.5):
+        self.log_queue = log_queue
+        self.on_attach = on_attach
+        self.on_detach = on_detach
+        self.poll_interval = poll_interval
+        self._ports = frozenset()
+        self._serials = {}  # port -> USB serial number
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="rtfed-hotplug", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def ports(self):
+        return self._ports
+
+    def serial_number(self, port):
+        return self._serials.get(port)
+
+    def _scan(self):
+        # port -> USB serial number
+        return {info.device: info.serial_number
+                for info in serial.tools.list_ports.comports() if is_fed3_port(info)}
+
+    def _notify(self, callback, port):
+        try:
+            callback(port)
+        except Exception as e:
+            self.log_queue.put(f"Error handling hotplug event for {port}: {e}")
+
+    def _update(self, current):
+        previous = self._ports
+        self._serials.update(current)
+        self._ports = frozenset(current)
+        for port in sorted(previous - self._ports):
+            self._notify(self.on_detach, port)
+        for port in sorted(self._ports - previous):
+            self._notify(self.on_attach, port)
+
+    def _run(self):
+        monitor = None
+        if pyudev is not None:
+            try:
+                monitor = pyudev.Monitor.from_netlink(pyudev.Context())
+                monitor.filter_by("tty")
+                monitor.start()
+            except Exception as e:
+                self.log_queue.put(f"udev monitoring unavailable ({e}); polling for FED3 ports.")
+                monitor = None
+        # Subscribe before the first scan so nothing attached in between is missed
+        self._update(self._scan())
+        if monitor is not None:
+            self._run_udev(monitor)
+        else:
+            while not self._stop_event.wait(self.poll_interval):
+                self._update(self._scan())
+
+    def _run_udev(self, monitor):
+        fed3_ids = ("%04x" % FED3_USB_IDS[0], "%04x" % FED3_USB_IDS[1])
+        while not self._stop_event.is_set():
+            device = monitor.poll(timeout=0.5)
+            if device is None or not device.device_node:
+                continue
+            port = device.device_node
+            if device.action == "add":
+                ids = (device.properties.get("ID_VENDOR_ID", "").lower(),
+                       device.properties.get("ID_MODEL_ID", "").lower())
+                if ids == fed3_ids and port not in self._ports:
+                    current = {p: self._serials.get(p) for p in self._ports}
+                    current[port] = device.properties.get("ID_SERIAL_SHORT")
+                    self._update(current)
+            elif device.action == "remove" and port in self._ports:
+                self._update({p: self._serials.get(p) for p in self._ports if p != port})
+
+
+class DeviceRegistry:
+    """
+    Remembers FED3 units across sessions by USB serial number: Device_Number, last session
+    type and mode, and last port, in a small JSON file under RTFED_HOME. A known unit can
+    start logging without being identified first; its entry is trusted until the unit's
+    own first data line says otherwise.
+    """
+    def __init__(self, path, log_queue):
+        self.path = path
+        self.log_queue = log_queue
+        self._lock = threading.Lock()
+        self._devices = {}
+        if os.path.exists(path):
+            try:
+                with open(path) as f:
+                    self._devices = json.load(f)
+            except (OSError, ValueError) as e:
+                log_queue.put(f"Could not read device registry {path}: {e}")
+
+    def lookup(self, serial_number):
+        if not serial_number:
+            return None
+        with self._lock:
+            entry = self._devices.get(serial_number)
+            return dict(entry) if entry else None
+
+    def remember(self, serial_number, **fields):
+        if not serial_number:
+            return
+        fields = {key: value for key, value in fields.items() if value is not None}
+        with self._lock:
+            entry = self._devices.setdefault(serial_number, {})
+            if all(entry.get(key) == value for key, value in fields.items()):
+                return
+            entry.update(fields)
+            entry["updated"] = datetime.datetime.now().isoformat(timespec="seconds")
+            try:
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+                tmp_path = self.path + ".tmp"
+                with open(tmp_path, "w") as f:
+                    json.dump(self._devices, f, indent=1, sort_keys=True)
+                os.replace(tmp_path, self.path)
+            except OSError as e:
+                self.log_queue.put(f"Could not update device registry {self.path}: {e}")
+
+
+class StageTimer:
+    """Busy time and item counts of one pipeline stage, reported and reset per interval."""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self.calls = 0
+        self.items = 0
+        self.busy = 0.0
+        self.longest = 0.0
+        self.since = time.perf_counter()
+
+    def add(self, seconds, items=1):
+        with self._lock:
+            self.calls += 1
+            self.items += items
+            self.busy += seconds
+            if seconds > self.longest:
+                self.longest = seconds
+
+    def report(self, unit):
+        with self._lock:
+            window = max(time.perf_counter() - self.since, 1e-9)
+            text = (f"{self.items} {unit} in {self.calls} calls, busy {self.busy * 1000:.1f} ms "
+                    f"({100 * self.busy / window:.2f}% of {window:.0f} s), longest {self.longest * 1000:.1f} ms")
+            self._reset()
+        return text
+
+
+class LineFramer:
+    """
+    Incremental line splitter for FED3 serial streams. Incoming bytes are appended to one
+    reusable bytearray, complete lines are decoded straight from memoryview slices and the
+    trailing partial line is carried over to the next read.
+    """
+    def __init__(self, max_line_length=4096):
+        self.max_line_length = max_line_length
+        self._buffer = bytearray()
+
+    def feed(self, data):
+        buffer = self._buffer
+        buffer += data
+        lines = []
+        start = 0
+        find = buffer.find
+        with memoryview(buffer) as view:
+            end = find(b"\n", start)
+            while end >= 0:
+                line = str(view[start:end], 'utf-8', 'replace').strip()
+                if line:
+                    lines.append(line)
+                start = end + 1
+                end = find(b"\n", start)
+        if start:
+            del buffer[:start]
+        if len(buffer) > self.max_line_length:
+            # Chatter without a newline (e.g. a board rebooting mid-line); drop it
+            buffer.clear()
+        return lines
+
+    def read_lines(self, ser):
+        # One read() for everything already buffered; if nothing is waiting, block up to the
+        # port timeout for the first byte instead of spinning.
+        waiting = ser.in_waiting
+        data = ser.read(waiting if waiting else 1)
+        waiting = ser.in_waiting
+        if waiting:
+            data += ser.read(waiting)
+        return self.feed(data) if data else []
+
+    def reset(self):
+        self._buffer.clear()
+
+
+class StallWatchdog:
+    """
+    Finds ports that have gone silent without an error, as happens when a USB hub browns
+    out. FED3s only write on events, so a port quiet for quiet_timeout is probed first;
+    it is stalled if nothing at all arrives within probe_timeout of the probe.
+    Ports sit in two OrderedDicts kept in order of their last byte / probe time, so each
+    check only looks at the oldest entries: O(1) per tick, however many ports are open.
+    """
+    def __init__(self, quiet_timeout=300, probe_timeout=10):
+        self.quiet_timeout = quiet_timeout
+        self.probe_timeout = probe_timeout
+        self._heard = OrderedDict()  # port -> time of last byte, oldest first
+        self._probed = OrderedDict()  # port -> time of probe, oldest first
+
+    def heard(self, port, now):
+        self._probed.pop(port, None)
+        self._heard[port] = now
+        self._heard.move_to_end(port)
+
+    def remove(self, port):
+        self._heard.pop(port, None)
+        self._probed.pop(port, None)
+
+    def due(self, now):
+        # (ports to probe, stalled ports); each is reported once until heard() again
+        to_probe = []
+        while self._heard:
+            port, last = next(iter(self._heard.items()))
+            if now - last < self.quiet_timeout:
+                break
+            del self._heard[port]
+            self._probed[port] = now
+            to_probe.append(port)
+        stalled = []
+        while self._probed:
+            port, probed_at = next(iter(self._probed.items()))
+            if now - probed_at < self.probe_timeout:
+                break
+            del self._probed[port]
+            stalled.append(port)
+        return to_probe, stalled
+
+
+class SerialReactor:
+    """
+    Owns every open FED3 serial handle and services all of them from one thread.
+    Ports that expose a file descriptor (Linux/macOS) are multiplexed with selectors,
+    ports that don't (Windows) are polled through in_waiting. Complete lines are handed
+    to the pipeline registered for the port, so the thread count stays fixed no matter
+    how many FED3 units are connected.
+    Each read drains everything the OS has buffered and stamps it with the arrival time.
+    Polled ports are revisited after min_poll_interval while busy, backing off to
+    max_poll_interval only once they go quiet.
+    Failed opens are retried after delay, multiplied by backoff on each attempt up to
+    max_delay; retries=None never gives up. A pipeline with a `reconnect` tuple of
+    (delay, backoff, max_delay) is re-armed that way whenever its port fails.
+    With a StallWatchdog, quiet ports get pipeline.probe() and stalled ones
+    pipeline.handle_stall(silent_for) before being failed like a read error.
+    """
+    def __init__(self, log_queue, idle_timeout=0.1, tick_interval=0.5,
+                 min_poll_interval=0.002, max_poll_interval=0.02, watchdog=None):
+        self.log_queue = log_queue
+        self.watchdog = watchdog
+        self.idle_timeout = idle_timeout
+        self.tick_interval = tick_interval
+        self.min_poll_interval = min_poll_interval
+        self.max_poll_interval = max_poll_interval
+        self._poll_wait = min_poll_interval
+        self._selector = selectors.DefaultSelector()
+        self._handles = {}  # port -> (ser, pipeline)
+        self._polled = {}  # port -> ser, for handles without a usable fileno()
+        self._fds = {}  # port -> fd, read directly so no pyserial select() call is involved
+        self._framers = {}  # port -> LineFramer
+        self._pending_opens = {}  # port -> (pipeline, attempt, retries, delays, next_attempt_time)
+        self._changes = queue.Queue()
+        self._stop_event = threading.Event()
+        self._thread = None
+        self._last_tick = 0.0
+        self.stats = StageTimer()
+        self._wakeup_r = self._wakeup_w = None
+        if os.name != "nt":
+            self._wakeup_r, self._wakeup_w = os.pipe()
+            os.set_blocking(self._wakeup_r, False)
+            self._selector.register(self._wakeup_r, selectors.EVENT_READ, None)
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name="rtfed-serial-reactor", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        self._wake()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self._selector.close()
+        if self._wakeup_r is not None:
+            wakeup_r, wakeup_w = self._wakeup_r, self._wakeup_w
+            self._wakeup_r = self._wakeup_w = None
+            os.close(wakeup_r)
+            os.close(wakeup_w)
+
+    def open_port(self, port, pipeline, retries=5, delay=2, backoff=1.0, max_delay=None):
+        # Opening happens on the reactor thread; failed attempts are rescheduled there too.
+        self._changes.put(("open", port, (pipeline, retries, (delay, backoff, max_delay or delay))))
+        self._wake()
+
+    def retry_now(self, port):
+        # Skip the remaining backoff of a pending open, e.g. when hotplug reports the port is back
+        self._changes.put(("retry", port, None))
+        self._wake()
+
+    def close_port(self, port):
+        self._changes.put(("close", port, None))
+        self._wake()
+
+    def close_all(self, timeout=5):
+        # Blocks until the reactor has closed every handle, so callers can safely save afterwards.
+        done = threading.Event()
+        self._changes.put(("close_all", None, done))
+        self._wake()
+        if self._thread is None or not self._thread.is_alive():
+            self._apply_changes()
+        done.wait(timeout)
+
+    def is_open(self, port):
+        return port in self._handles or port in self._pending_opens
+
+    def _wake(self):
+        if self._wakeup_w is not None:
+            try:
+                os.write(self._wakeup_w, b"\0")
+            except OSError:
+                pass
+
+    def _drain_wakeup(self):
+        try:
+            while os.read(self._wakeup_r, 512):
+                pass
+        except (BlockingIOError, OSError):
+            pass
+
+    def _apply_changes(self):
+        while True:
+            try:
+                action, port, arg = self._changes.get_nowait()
+            except queue.Empty:
+                break
+            if action == "open":
+                pipeline, retries, delays = arg
+                if port not in self._handles:
+                    self._pending_opens[port] = (pipeline, 1, retries, delays, 0.0)
+            elif action == "retry":
+                if port in self._pending_opens:
+                    self._pending_opens[port] = self._pending_opens[port][:4] + (0.0,)
+            elif action == "close":
+                self._pending_opens.pop(port, None)
+                self._release(port)
+            elif action == "close_all":
+                self._pending_opens.clear()
+                for p in list(self._handles):
+                    self._release(p)
+                arg.set()
+
+    def _attempt_opens(self, now):
+        for port, (pipeline, attempt, retries, delays, next_attempt) in list(self._pending_opens.items()):
+            if now < next_attempt:
+                continue
+            try:
+                ser = serial.Serial(port, 115200, timeout=0.1)
+            except serial.SerialException as e:
+                delay, backoff, max_delay = delays
+                wait = min(delay * backoff ** (attempt - 1), max_delay)
+                # Unlimited retries would flood the log; report attempts 1, 2, 4, 8, ...
+                if retries is not None or attempt & (attempt - 1) == 0:
+                    self.log_queue.put(f"Attempt {attempt}: Error with port {port}: {e}")
+                if retries is not None and attempt >= retries:
+                    del self._pending_opens[port]
+                    self.log_queue.put(f"Failed to connect to port {port} after {retries} attempts.")
+                else:
+                    self._pending_opens[port] = (pipeline, attempt + 1, retries, delays, now + wait)
+                continue
+            del self._pending_opens[port]
+            self._register(port, ser, pipeline)
+            pipeline.handle_open(ser)
+
+    def _register(self, port, ser, pipeline):
+        self._handles[port] = (ser, pipeline)
+        self._framers[port] = LineFramer()
+        if self.watchdog is not None:
+            self.watchdog.heard(port, time.time())
+        try:
+            fd = ser.fileno()
+        except (AttributeError, OSError, ValueError):
+            fd = None
+        if fd is not None and self._wakeup_r is not None:
+            self._selector.register(fd, selectors.EVENT_READ, port)
+            self._fds[port] = fd
+        else:
+            self._polled[port] = ser
+
+    def _release(self, port):
+        entry = self._handles.pop(port, None)
+        if entry is None:
+            return None
+        ser, pipeline = entry
+        self._framers.pop(port, None)
+        self._polled.pop(port, None)
+        if self.watchdog is not None:
+            self.watchdog.remove(port)
+        fd = self._fds.pop(port, None)
+        if fd is not None:
+            try:
+                self._selector.unregister(fd)
+            except (KeyError, ValueError, OSError):
+                pass
+        try:
+            if ser.is_open:
+                ser.close()
+        except Exception:
+            pass
+        return pipeline
+
+    def _fail(self, port, error):
+        pipeline = self._release(port)
+        if pipeline is None:
+            return
+        pipeline.handle_disconnect(error)
+        delays = getattr(pipeline, "reconnect", None)
+        if delays:
+            self._pending_opens[port] = (pipeline, 1, None, delays, time.time() + delays[0])
+
+    def _read_available(self, port, ser):
+        fd = self._fds.get(port)
+        if fd is None:
+            chunks = []
+            waiting = ser.in_waiting
+            while waiting:
+                chunks.append(ser.read(waiting))
+                waiting = ser.in_waiting
+            return b"".join(chunks)
+        # pyserial's own read() goes through select.select(), which fails for fd >= 1024
+        chunks = []
+        while True:
+            try:
+                data = os.read(fd, 65536)
+            except BlockingIOError:
+                break
+            if not data:
+                if chunks:
+                    break
+                raise serial.SerialException(
+                    "device reports readiness to read but returned no data (device disconnected?)")
+            chunks.append(data)
+            if len(data) < 65536:
+                break
+        return b"".join(chunks)
+
+    def _service(self, port):
+        entry = self._handles.get(port)
+        if entry is None:
+            return
+        ser, pipeline = entry
+        started = time.perf_counter()
+        try:
+            data = self._read_available(port, ser)
+        except (serial.SerialException, OSError) as e:
+            self._fail(port, e)
+            return
+        if not data:
+            return
+        arrival = time.time()
+        if self.watchdog is not None:
+            self.watchdog.heard(port, arrival)
+        lines = self._framers[port].feed(data)
+        for line in lines:
+            try:
+                pipeline.handle_line(line, arrival)
+            except Exception as e:
+                self.log_queue.put(f"Error processing data from {port}: {e}")
+        self.stats.add(time.perf_counter() - started, len(lines))
+
+    def _tick(self, now):
+        for ser, pipeline in list(self._handles.values()):
+            try:
+                pipeline.tick(now)
+            except Exception as e:
+                self.log_queue.put(f"Error in pipeline for {pipeline.port}: {e}")
+        if self.watchdog is not None:
+            self._check_stalls(now)
+
+    def _check_stalls(self, now):
+        to_probe, stalled = self.watchdog.due(now)
+        for port in to_probe:
+            try:
+                self._handles[port][1].probe()
+            except Exception as e:
+                self.log_queue.put(f"Error probing {port}: {e}")
+        for port in stalled:
+            silent_for = self.watchdog.quiet_timeout + self.watchdog.probe_timeout
+            try:
+                self._handles[port][1].handle_stall(silent_for)
+            except Exception as e:
+                self.log_queue.put(f"Error in pipeline for {port}: {e}")
+            # Reopening is the only cure for a handle that stopped delivering data
+            self._fail(port, serial.SerialException(f"no data for {silent_for:.0f} s and no reply to a probe"))
+
+    def _run(self):
+        while not self._stop_event.is_set():
+            self._apply_changes()
+            now = time.time()
+            if self._pending_opens:
+                self._attempt_opens(now)
+            ready = []
+            # Block in select() only when every handle is selectable; polled handles need a timely look.
+            blocking = self._wakeup_r is not None and not self._polled
+            if self._wakeup_r is not None:
+                timeout = self.idle_timeout if blocking else 0
+                for key, _ in self._selector.select(timeout):
+                    if key.data is None:
+                        self._drain_wakeup()
+                    else:
+                        ready.append(key.data)
+            for port, ser in list(self._polled.items()):
+                try:
+                    if ser.in_waiting:
+                        ready.append(port)
+                except (serial.SerialException, OSError) as e:
+                    self._fail(port, e)
+            for port in ready:
+                self._service(port)
+            now = time.time()
+            if now - self._last_tick >= self.tick_interval:
+                self._tick(now)
+                self._last_tick = now
+            if ready:
+                self._poll_wait = self.min_poll_interval
+            elif not blocking:
+                self._stop_event.wait(self._poll_wait)
+                self._poll_wait = min(self._poll_wait * 2, self.max_poll_interval)
+        self._apply_changes()
+        for port in list(self._handles):
+            self._release(port)
+
+
+CommandReply = namedtuple("CommandReply", ["line", "result", "sent_at", "arrival"])
+
+
+class CommandChannel:
+    """
+    Commands for one FED3 over a connection that a SerialReactor is already reading.
+    send() writes the command and returns a Future that resolves to a CommandReply for the
+    first line its match(line) accepts (returns something other than None), or fails with
+    TimeoutError or the serial error. Writes are serialised and pending commands are matched
+    in the order they were sent. A matched acknowledgement (TIME_SET_OK, MODE_SET_OK, ...) is
+    consumed; with consume=False the line is only observed and still reaches the parser, which
+    is how a TRIGGER_POKE waits for the data row the poke produces.
+    """
+    def __init__(self, port):
+        self.port = port
+        self._ser = None
+        self._lock = threading.Lock()
+        self._pending = []  # [match, consume, future, sent_at, deadline] in send order
+
+    @property
+    def is_open(self):
+        return self._ser is not None
+
+    def attach(self, ser):
+        self._ser = ser
+
+    def detach(self, error):
+        with self._lock:
+            self._ser = None
+            pending, self._pending = self._pending, []
+        for _, _, future, _, _ in pending:
+            future.set_exception(serial.SerialException(f"{self.port} closed: {error}"))
+
+    def send(self, command, match, timeout=2.0, consume=True):
+        if isinstance(command, str):
+            command = command.encode("utf-8")
+        future = Future()
+        with self._lock:
+            if self._ser is None:
+                future.set_exception(serial.SerialException(f"{self.port} is not open"))
+                return future
+            try:
+                sent_at = time.time()
+                self._ser.write(command)
+            except (serial.SerialException, OSError) as e:
+                future.set_exception(e)
+                return future
+            self._pending.append([match, consume, future, sent_at, sent_at + timeout])
+        return future
+
+    def offer(self, line, arrival):
+        # Reactor thread, for every line read from the port; True if a command consumed it
+        if not self._pending:
+            return False
+        resolved = []
+        consumed = False
+        with self._lock:
+            for entry in list(self._pending):
+                match, consume, future, sent_at, _ = entry
+                try:
+                    result = match(line)
+                except Exception as e:
+                    self._pending.remove(entry)
+                    resolved.append((future, None, e))
+                    continue
+                if result is not None:
+                    self._pending.remove(entry)
+                    resolved.append((future, CommandReply(line, result, sent_at, arrival), None))
+                    consumed = consume
+                    break
+        for future, reply, error in resolved:
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(reply)
+        return consumed
+
+    def expire(self, now):
+        if not self._pending:
+            return
+        with self._lock:
+            expired = [entry for entry in self._pending if entry[4] <= now]
+            for entry in expired:
+                self._pending.remove(entry)
+        for _, _, future, _, _ in expired:
+            future.set_exception(TimeoutError(f"No reply from {self.port}"))
+
+
+class _CommandPipeline:
+    # Reactor pipeline for a port opened only to send it commands
+    def __init__(self, port, opened, log_queue):
+        self.port = port
+        self.channel = CommandChannel(port)
+        self.opened = opened
+        self.log_queue = log_queue
+
+    def handle_open(self, ser):
+        self.channel.attach(ser)
+        self.opened[self.port] = self.channel
+
+    def handle_line(self, line, arrival):
+        self.channel.offer(line, arrival)
+
+    def handle_disconnect(self, error):
+        self.log_queue.put(f"Device on {self.port} disconnected: {error}")
+        self.opened.pop(self.port, None)
+        self.channel.detach(error)
+
+    def tick(self, now):
+        self.channel.expire(now)
+
+
+class PortChannels:
+    """
+    Context manager giving a CommandChannel for each of `ports`: the logging connection's
+    channel where one exists (from `shared`, waiting for it if it is reconnecting),
+    otherwise a connection opened for the duration on a private SerialReactor. Ports that
+    can't be opened within open_timeout are left out of the mapping.
+    """
+    def __init__(self, log_queue, ports, shared=None, open_timeout=2.0):
+        self.log_queue = log_queue
+        self.ports = list(ports)
+        self.shared = shared or {}
+        self.open_timeout = open_timeout
+        self._reactor = None
+
+    def __enter__(self):
+        channels = {}
+        missing = []
+        reconnecting = []
+        for port in self.ports:
+            channel = self.shared.get(port)
+            if channel is None:
+                missing.append(port)
+            elif channel.is_open:
+                channels[port] = channel
+            else:
+                # Its logging connection is being reopened; a second connection would race it
+                reconnecting.append(port)
+        deadline = time.time() + self.open_timeout
+        opened = {}
+        if missing:
+            self._reactor = SerialReactor(self.log_queue)
+            self._reactor.start()
+            for port in missing:
+                self._reactor.open_port(port, _CommandPipeline(port, opened, self.log_queue), retries=1, delay=0)
+        while time.time() < deadline:
+            back = [port for port in reconnecting if self.shared[port].is_open]
+            if len(opened) == len(missing) and len(back) == len(reconnecting):
+                break
+            time.sleep(0.01)
+        channels.update(opened)
+        channels.update((port, self.shared[port]) for port in reconnecting if self.shared[port].is_open)
+        return channels
+
+    def __exit__(self, *exc_info):
+        if self._reactor is not None:
+            self._reactor.close_all()
+            self._reactor.stop()
+            self._reactor = None
+        return False
+
+
+class FleetQuery:
+    """
+    Sends one command to many FED3 ports at once and collects the first matching reply from
+    each, with a single deadline for the whole fleet, so the fleet takes about as long as its
+    slowest device. Ports being logged get the command on their logging connection (pass
+    their channels); the rest are opened on a private reactor for the query.
+    match(port, line) returns None until a line answers the command; on_result(port, result,
+    latency) is called from the reactor thread as each port answers.
+    """
+    def __init__(self, log_queue, command, match, timeout=3.0, on_result=None,
+                 channels=None, consume=True):
+        self.log_queue = log_queue
+        self.command = command if isinstance(command, bytes) else command.encode("utf-8")
+        self.match = match
+        self.timeout = timeout
+        self.on_result = on_result
+        self.channels = channels
+        self.consume = consume
+        self._closed = False
+
+    def _answered(self, port, future):
+        if self._closed or future.cancelled() or future.exception() is not None:
+            return
+        reply = future.result()
+        if self.on_result is not None:
+            try:
+                self.on_result(port, reply.result, reply.arrival - reply.sent_at)
+            except Exception as e:
+                self.log_queue.put(f"Error handling reply from {port}: {e}")
+
+    def run(self, ports):
+        # Returns {port: (result, latency in s)} for the ports that answered before the deadline
+        deadline = time.time() + self.timeout
+        futures = {}
+        with PortChannels(self.log_queue, ports, self.channels, open_timeout=self.timeout) as channels:
+            remaining = max(0.0, deadline - time.time())
+            for port, channel in channels.items():
+                future = channel.send(self.command, functools.partial(self.match, port),
+                                      timeout=remaining, consume=self.consume)
+                future.add_done_callback(functools.partial(self._answered, port))
+                futures[port] = future
+            wait_futures(futures.values(), timeout=max(0.0, deadline - time.time()))
+            self._closed = True
+        replies = {}
+        for port, future in futures.items():
+            if future.done() and not future.cancelled() and future.exception() is None:
+                reply = future.result()
+                replies[port] = (reply.result, reply.arrival - reply.sent_at)
+        return replies
+
+
+_device_dates = {}
+
+def parse_device_time(text):
+    # FED3 RTC stamp "MM/DD/YYYY hh:mm:ss" (local time, as set by SET_TIME) -> epoch seconds
+    date, _, clock = text.strip().partition(" ")
+    midnight = _device_dates.get(date)
+    if midnight is None:
+        try:
+            month, day, year = (int(v) for v in date.split("/"))
+            midnight = time.mktime((year, month, day, 0, 0, 0, 0, 0, -1))
+        except (ValueError, OverflowError):
+            return None
+        _device_dates[date] = midnight
+    try:
+        hours, minutes, seconds = clock.split(":")
+        return midnight + int(hours) * 3600 + int(minutes) * 60 + float(seconds)
+    except ValueError:
+        return None
+
+
+class ClockDriftTracker:
+    """
+    Online least-squares fit of one device's clock against the host clock since the device
+    was last synced: device - host = offset + drift * (t - t0). The FED3 stamp only has
+    whole seconds, so each sample is taken at the middle of its second; the offset settles
+    after a few dozen events, the drift (reported in ppm) only once the samples span
+    min_span seconds.
+    """
+    def __init__(self, min_span=600):
+        self.min_span = min_span
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.t0 = None
+            self.last = None
+            self.samples = 0
+            self._sx = self._sy = self._sxx = self._sxy = 0.0
+
+    def add(self, host, device):
+        with self._lock:
+            if self.t0 is None:
+                self.t0 = host
+            x = host - self.t0
+            y = device + 0.5 - host
+            self.samples += 1
+            self._sx += x
+            self._sy += y
+            self._sxx += x * x
+            self._sxy += x * y
+            self.last = host
+
+    def estimate(self, now):
+        # (offset at `now` in s, drift in ppm or None, samples), or None before any sample
+        with self._lock:
+            n = self.samples
+            if not n:
+                return None
+            mean_x, mean_y = self._sx / n, self._sy / n
+            var_x = self._sxx / n - mean_x * mean_x
+            if self.last - self.t0 < self.min_span or var_x <= 0:
+                return mean_y, None, n
+            slope = (self._sxy / n - mean_x * mean_y) / var_x
+            return mean_y + slope * (now - self.t0 - mean_x), slope * 1e6, n
+
+
+def set_time_command(second):
+    # The FED3 RTC takes local wall-clock time at one-second resolution
+    t = datetime.datetime.fromtimestamp(second)
+    return f"SET_TIME:{t.year},{t.month},{t.day},{t.hour},{t.minute},{t.second}\n".encode("utf-8")
+
+
+# A SET_TIME the firmware can't parse: it answers TIME_SET_FAIL and leaves its clock alone
+SET_TIME_PROBE = b"SET_TIME:?\n"
+
+
+def _time_set_reply(line):
+    return line if line in ("TIME_SET_OK", "TIME_SET_FAIL") else None
+
+
+class ClockSync:
+    """
+    Sets the clock of a group of FED3s so they agree with the host, and with each other, to
+    within a few milliseconds of serial latency. A first round of SET_TIME_PROBE, which the
+    firmware rejects without touching its clock, measures each port's round trip. The real
+    SET_TIME for second S is then written to each port at S - rtt/2, so every device gets
+    its command as the host clock crosses S.
+    The replies to that round give the estimated residual offset of each device (device
+    minus host, at the moment the time was set), assuming the firmware applies the time as
+    the command arrives and the two directions of the link take equally long.
+    """
+    def __init__(self, log_queue, reply_timeout=2.0, margin=0.25, spin=0.02):
+        self.log_queue = log_queue
+        self.reply_timeout = reply_timeout
+        self.margin = margin
+        self.spin = spin
+
+    def _wait_until(self, when):
+        # time.sleep() can overshoot by a scheduler tick (~15 ms on Windows), so the last
+        # stretch before the send time is spent spinning
+        remaining = when - time.time()
+        if remaining > self.spin:
+            time.sleep(remaining - self.spin)
+        while time.time() < when:
+            pass
+
+    def _exchange(self, sends):
+        # sends: [(send_at, port, channel, payload)]; returns {port: CommandReply}
+        futures = {}
+        for send_at, port, channel, payload in sorted(sends, key=lambda send: send[0]):
+            self._wait_until(send_at)
+            futures[port] = channel.send(payload, _time_set_reply, timeout=self.reply_timeout)
+        wait_futures(futures.values(), timeout=self.reply_timeout)
+        replies = {}
+        for port, future in futures.items():
+            if not future.done():
+                continue
+            error = future.exception()
+            if error is None:
+                replies[port] = future.result()
+            elif not isinstance(error, TimeoutError):
+                self.log_queue.put(f"Failed to sync time for {port}: {error}")
+        return replies
+
+    def run(self, channels):
+        # channels: {port: CommandChannel}; returns {port: estimated offset in s}
+        if not channels:
+            return {}
+        now = time.time()
+        probe = self._exchange([(now, port, channel, SET_TIME_PROBE) for port, channel in channels.items()])
+        rtts = {}
+        for port in channels:
+            reply = probe.get(port)
+            if reply is None:
+                self.log_queue.put(f"Time sync command sent to {port}, no confirmation.")
+            else:
+                rtts[port] = reply.arrival - reply.sent_at
+        if not rtts:
+            return {}
+        target = math.floor(time.time() + max(rtts.values()) / 2 + self.margin) + 1
+        payload = set_time_command(target)
+        aligned = self._exchange([(target - rtt / 2, port, channels[port], payload) for port, rtt in rtts.items()])
+        offsets = {}
+        for port in rtts:
+            reply = aligned.get(port)
+            if reply is None or reply.line != "TIME_SET_OK":
+                self.log_queue.put(f"Time sync command sent to {port}, no confirmation.")
+                continue
+            rtt = reply.arrival - reply.sent_at
+            offsets[port] = target - (reply.sent_at + rtt / 2)
+            self.log_queue.put(f"Time synced for device on {port}: offset {offsets[port] * 1000:+.1f} ms "
+                               f"(round trip {rtt * 1000:.1f} ms)")
+        if offsets:
+            spread = max(offsets.values()) - min(offsets.values())
+            self.log_queue.put(f"Time synced on {len(offsets)}/{len(channels)} devices; estimated offsets "
+                               f"span {spread * 1000:.1f} ms.")
+        return offsets
+
+
+class Event(str, enum.Enum):
+    """Values of the FED3 Event column; anything unrecognised parses as OTHER."""
+    LEFT = "Left"
+    LEFT_SHORT = "LeftShort"
+    LEFT_WITH_PELLET = "LeftWithPellet"
+    LEFT_IN_TIMEOUT = "LeftinTimeOut"
+    LEFT_DURING_DISPENSE = "LeftDuringDispense"
+    RIGHT = "Right"
+    RIGHT_SHORT = "RightShort"
+    RIGHT_WITH_PELLET = "RightWithPellet"
+    RIGHT_IN_TIMEOUT = "RightinTimeout"
+    RIGHT_DURING_DISPENSE = "RightDuringDispense"
+    PELLET = "Pellet"
+    PELLET_IN_WELL = "PelletInWell"
+    JAM = "JAM"
+    OTHER = ""
+
+
+# Events that flash the port's poke indicator
+POKE_EVENTS = frozenset((Event.LEFT, Event.RIGHT, Event.PELLET,
+                         Event.LEFT_WITH_PELLET, Event.RIGHT_WITH_PELLET))
+
+
+class _EventTable(dict):
+    def __missing__(self, text):
+        return self.get(text.strip(), Event.OTHER)
+
+
+_EVENTS = _EventTable((event.value, event) for event in Event)
+
+# One field per column_headers entry (device clock first), plus the raw text of the data
+# columns as sent by the device, which is what the journal and Sheets rows are built from
+FED3Record = namedtuple("FED3Record", ["device_time"] + [name.lower() for name in column_headers[1:]] + ["fields"])
+
+
+# Cells the firmware prints where a column has no value for the event
+_NO_VALUE = frozenset(("", "NaN", "nan", "Timed_out", "Error"))
+
+
+def _float_cell(text):
+    if text in _NO_VALUE:
+        return None
+    try:
+        return float(text)
+    except ValueError:
+        return None
+
+def _int_cell(text):
+    if text.isdigit():
+        return int(text)
+    if text in _NO_VALUE:
+        return None
+    try:
+        return int(text)
+    except ValueError:
+        return None
+
+
+class FED3Parser:
+    """
+    Parser for FED3 CSV rows, set up once from a column_headers-style schema. parse()
+    splits the line once and converts each column with its converter (float, int, Event
+    or stripped text), returning a FED3Record or None. Numeric cells the firmware leaves
+    without a value (NaN, Timed_out, Error, empty) become None. FED3 rows start with the
+    device date, so serial chatter such as "Unixtime: ..." or ">> Bandit probs swapped" is
+    rejected on its first character without being split.
+    """
+    def __init__(self, schema=column_headers):
+        self.columns = len(schema)
+        self._converters = []
+        for name in schema[1:]:
+            if name in FLOAT_COLUMNS:
+                self._converters.append(_float_cell)
+            elif name in INT_COLUMNS:
+                self._converters.append(_int_cell)
+            elif name == "Event":
+                self._converters.append(_EVENTS.__getitem__)
+            else:
+                self._converters.append(str.strip)
+        self.rejected = 0
+        self.malformed = 0
+
+    @staticmethod
+    def is_candidate(line):
+        return line[:1].isdigit()
+
+    def parse(self, line):
+        if not line[:1].isdigit():
+            self.rejected += 1
+            return None
+        parts = line.split(",")
+        if len(parts) < self.columns:
+            self.malformed += 1
+            return None
+        values = [convert(text) for convert, text in zip(self._converters, parts[1:])]
+        return FED3Record(parts[0], *values, parts[1:])
+
+
+class DevicePipeline:
+    """
+    Per-device stage fed by the SerialReactor from the moment the port is attached: parses
+    FED3 CSV lines, keeps the local copy of the session and queues rows for the
+    SheetsUploader. Nothing here waits on the network.
+    Until begin_logging() it only watches: the first row carrying a Device_Number
+    identifies the device, so START logs on the connection that is already open.
+    When the device drops off (restart, jam clearing, loose cable) the reactor keeps
+    reopening the port with `reconnect` backoff and hands it back to this same pipeline, so
+    the device number, journal and sheet carry on; the outage is written to the journal
+    and Sheets as a "Disconnected" / "Reconnected" pair of marker rows. A port that goes
+    silent without an error is caught by the reactor's StallWatchdog and reopened the same way;
+    its outage gets one marker pair however often it is reopened, and only ends when data
+    arrives again.
+    """
+    GAP_START = "Disconnected"
+    GAP_END = "Reconnected"
+
+    def __init__(self, app, port, reconnect=None):
+        self.app = app
+        self.port = port
+        self.device_number = app.port_to_device_number.get(port, "unknown")
+        self.worksheet_name = f"Device_{self.device_number}"
+        self.logging = False
+        self.parser = FED3Parser()
+        # Commands to this device share the reader connection (see CommandChannel)
+        self.channel = CommandChannel(port)
+        self.journal = None
+        self.store = None
+        self.drift = None
+        self.reconnect = reconnect  # (first delay, backoff factor, max delay) in s
+        self.disconnected_at = None
+        self.check_next_row = True
+        self.last_event_time = None
+        self.stalls = 0
+        self.stalled = False
+
+    def begin_logging(self):
+        # Tk thread; rows from the reactor thread are logged from the next one on
+        app = self.app
+        self.device_number = app.port_to_device_number.get(self.port, self.device_number)
+        self.worksheet_name = f"Device_{self.device_number}"
+        self.store = app.row_store_for(self.port)
+        self.drift = app.drift_tracker_for(self.port)
+        self.logging = True
+        app.log_queue.put(f"Started logging from {self.port} with sheet {self.worksheet_name}.")
+
+    def handle_open(self, ser):
+        app = self.app
+        self.channel.attach(ser)
+        self.check_next_row = True
+        # A stalled port keeps its "Stalled" status until data actually flows again
+        if not self.stalled:
+            app.set_port_status(self.port, "Ready", "green")
+        if self.disconnected_at is None:
+            app.log_queue.put(f"Listening on {self.port}.")
+            return
+        if self.stalled:
+            # Reopening a silent port doesn't end the outage; the first row does (handle_line)
+            app.log_queue.put(f"Reopened {self.port} ({self.worksheet_name}); still waiting for data.")
+            return
+        self.end_gap(time.time())
+
+    def end_gap(self, now):
+        self.app.log_queue.put(f"Reconnected {self.port} ({self.worksheet_name}) after "
+                               f"{now - self.disconnected_at:.1f} s offline.")
+        self.disconnected_at = None
+        self.write_marker(now, self.GAP_END)
+
+    def handle_disconnect(self, error):
+        app = self.app
+        app.log_queue.put(f"Device on {self.port} disconnected: {error}")
+        self.channel.detach(error)
+        if self.disconnected_at is None:
+            self.disconnected_at = time.time()
+            self.write_marker(self.disconnected_at, self.GAP_START)
+        if self.stalled:
+            app.set_port_status(self.port, "Stalled", "orange")
+        else:
+            app.set_port_status(self.port, "Reconnecting" if self.reconnect else "Not Ready", "red")
+
+    def write_marker(self, timestamp, event):
+        # Gap markers only make sense once this device has rows in the session
+        if self.journal is None:
+            return
+        row = make_marker_row(self.device_number, timestamp, event)
+        self.journal.append(row)
+        self.app.uploader.enqueue_row(self, row)
+
+    def probe(self):
+        # Liveness check for a quiet port (see SET_TIME_PROBE)
+        self.channel.send(SET_TIME_PROBE, _time_set_reply, timeout=self.app.stall_probe_timeout)
+
+    def handle_stall(self, silent_for):
+        self.stalls += 1
+        # Alert once per outage, not on every reopen of a port that is still dead
+        if not self.stalled:
+            self.stalled = True
+            self.app.report_stall(self.port, silent_for)
+
+    def handle_line(self, line, arrival):
+        app = self.app
+        port_identifier = self.port
+        if self.stalled:
+            self.stalled = False
+            app.log_queue.put(f"Data is arriving from {port_identifier} again.")
+            app.set_port_status(port_identifier, "Ready", "green")
+            if self.disconnected_at is not None:
+                self.end_gap(arrival)
+        if self.channel.offer(line, arrival):
+            return
+        record = self.parser.parse(line)
+        if record is None:
+            if self.parser.is_candidate(line):
+                app.log_queue.put(f"Warning: Data length mismatch on {port_identifier}")
+            return
+        if self.check_next_row and record.device_number:
+            # First row of each connection: the device behind the port may have changed
+            self.check_next_row = False
+            self.check_device(record)
+        if not self.logging:
+            if record.event in POKE_EVENTS and port_identifier in app.port_queues:
+                app.port_queues[port_identifier].put("RIGHT_POKE")
+            return
+        self.last_event_time = arrival
+        if self.journal is None:
+            self.journal = app.journal_for(port_identifier)
+        data_list = record.fields
+        row_data = [format_host_time(arrival)] + data_list
+        app.uploader.enqueue_row(self, row_data)
+        if port_identifier in app.port_queues:
+            app.port_queues[port_identifier].put(f"Data logged: {data_list}")
+        self.journal.append(row_data)
+        device_time = parse_device_time(record.device_time)
+        self.store.append(arrival, data_list, device_time)
+        if device_time is not None:
+            self.drift.add(arrival, device_time)
+        if record.event is Event.JAM:
+            app.uploader.enqueue_jam(self)
+        if record.event in POKE_EVENTS:
+            if port_identifier in app.port_queues:
+                app.port_queues[port_identifier].put("RIGHT_POKE")
+
+    def check_device(self, record):
+        # The first row settles which device this is before anything is named after it
+        # (journal file, worksheet); the mapping may have come from the device registry,
+        # a poke, or not exist yet
+        device_number = record.device_number
+        expected = self.app.port_to_device_number.get(self.port)
+        if expected is not None and device_number != expected:
+            self.app.log_queue.put(f"Device on {self.port} reports device_number={device_number}, "
+                                   f"not {expected}; logging it as Device_{device_number}.")
+        self.device_number = device_number
+        self.worksheet_name = f"Device_{device_number}"
+        self.app.confirm_device(self.port, device_number, record.session_type)
+
+    def tick(self, now):
+        self.channel.expire(now)
+        if self.journal is not None:
+            self.journal.sync_if_due()
+
+
+def api_error_status(error):
+    # HTTP status of a gspread APIError; None for anything else (network errors, ...)
+    import gspread
+    if not isinstance(error, gspread.exceptions.APIError):
+        return None
+    return getattr(error, "code", None) or getattr(getattr(error, "response", None), "status_code", 0)
+
+
+def is_transient_status(status):
+    # Rate limits and server errors go away by themselves; other API errors don't
+    return status == 429 or 500 <= status < 600
+
+
+class GoogleApiLimiter:
+    """
+    Shared gate in front of every gspread call. Read and write requests draw from separate
+    token buckets sized from the documented Google Sheets API quotas (60 read and 60 write
+    requests per minute per user), and 429/5xx answers are retried with capped exponential
+    backoff plus jitter. Callers block on this thread, never on the serial readers.
+    """
+    def __init__(self, log_queue, reads_per_minute=60, writes_per_minute=60,
+                 max_retries=5, max_backoff=64):
+        self.log_queue = log_queue
+        self.max_retries = max_retries
+        self.max_backoff = max_backoff
+        self._lock = threading.Lock()
+        self._rates = {"read": reads_per_minute / 60.0, "write": writes_per_minute / 60.0}
+        self._capacity = {"read": float(reads_per_minute), "write": float(writes_per_minute)}
+        self._tokens = dict(self._capacity)
+        self._refilled = time.monotonic()
+        self.backoff_until = 0.0
+        self.consecutive_failures = 0
+        self.throttled_seconds = 0.0
+
+    def _refill(self, now):
+        elapsed = now - self._refilled
+        self._refilled = now
+        for kind, rate in self._rates.items():
+            self._tokens[kind] = min(self._capacity[kind], self._tokens[kind] + elapsed * rate)
+
+    def _acquire(self, kind):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+                wait = self.backoff_until - now
+                if wait <= 0:
+                    if self._tokens[kind] >= 1:
+                        self._tokens[kind] -= 1
+                        return
+                    wait = (1 - self._tokens[kind]) / self._rates[kind]
+                self.throttled_seconds += wait
+            time.sleep(wait)
+
+    def call(self, kind, func, *args, **kwargs):
+        import gspread  # already loaded by FED3Monitor.connect_sheets
+        attempt = 0
+        while True:
+            self._acquire(kind)
+            try:
+                result = func(*args, **kwargs)
+            except gspread.exceptions.APIError as e:
+                status = api_error_status(e)
+                if not is_transient_status(status) or attempt >= self.max_retries:
+                    raise
+                attempt += 1
+                delay = min(self.max_backoff, 2 ** attempt) * random.uniform(0.5, 1.0)
+                with self._lock:
+                    self.consecutive_failures += 1
+                    self.backoff_until = max(self.backoff_until, time.monotonic() + delay)
+                self.log_queue.put(
+                    f"Google API returned {status}; backing off {delay:.1f} s "
+                    f"(retry {attempt}/{self.max_retries}). {self.status()}")
+                continue
+            with self._lock:
+                self.consecutive_failures = 0
+            return result
+
+    def status(self):
+        with self._lock:
+            self._refill(time.monotonic())
+            backoff = self.backoff_until - time.monotonic()
+            return (f"Tokens read {self._tokens['read']:.1f}/{self._capacity['read']:.0f}, "
+                    f"write {self._tokens['write']:.1f}/{self._capacity['write']:.0f}; "
+                    + (f"backing off {backoff:.1f} s after {self.consecutive_failures} failures"
+                       if backoff > 0 else "no backoff")
+                    + f"; throttled {self.throttled_seconds:.1f} s total")
+
+
+def get_or_create_worksheet(spreadsheet, title, limiter):
+    import gspread
+    try:
+        return limiter.call("read", spreadsheet.worksheet, title)
+    except gspread.exceptions.WorksheetNotFound:
+        sheet = limiter.call("write", spreadsheet.add_worksheet, title=title, rows="1000", cols="20")
+        limiter.call("write", sheet.append_row, column_headers)
+        return sheet
+
+def append_cells_request(sheet_id, rows):
+    # appendCells writes the values as-is, like append_rows() with value_input_option RAW
+    return {"appendCells": {
+        "sheetId": sheet_id,
+        "rows": [{"values": [{"userEnteredValue": {"stringValue": str(v)}} if v != '' else {} for v in row]}
+                 for row in rows],
+        "fields": "userEnteredValue",
+    }}
+
+
+class DeviceRowStore:
+    """
+    Columnar in-memory copy of the recent part of one device's session. Numeric columns are
+    typed arrays, repeated strings (Library_Version, Session_type, Device_Number, FR, Event,
+    ...) are interned as 16-bit codes and the host timestamp is an int64 epoch-ns, so an
+    event costs about 120 bytes instead of a list of 22 str objects. The cells the firmware
+    prints where a column has no value (NaN, Timed_out, Error, empty) are kept in-column as
+    a marker code. Values are stored so that rows() hands back exactly the text the FED3
+    sent, in column_headers order; anything else that doesn't fit its column type is kept
+    verbatim on the side. Only the last max_rows rows are kept (the whole session is in the
+    journal); `appended` counts every row of the session.
+    """
+    MARKERS = ("NaN", "", "Timed_out", "Error", "nan")
+    # Float cells: NaN with decimals -2 - k for MARKERS[k], -1 - len(MARKERS) for overflow.
+    # Int cells: INT_MARKER + k for MARKERS[k], INT_MISSING for overflow.
+    INT_MARKER = -2 ** 31
+    INT_MISSING = INT_MARKER + len(MARKERS)
+    CODE_MISSING = 0xFFFF
+
+    def __init__(self, max_rows=100000):
+        self.max_rows = max_rows
+        self.appended = 0
+        self.host_ns = array('q')
+        self.device_s = array('d')  # FED3 RTC time as epoch seconds, NaN if unreadable
+        self._columns = []  # per data column: (kind, values, decimals or None)
+        for name in column_headers[1:]:
+            if name in FLOAT_COLUMNS:
+                self._columns.append(('f', array('d'), array('b')))
+            elif name in INT_COLUMNS:
+                self._columns.append(('i', array('i'), None))
+            else:
+                self._columns.append(('c', array('H'), None))
+        self._index = {name: i for i, name in enumerate(column_headers[1:])}
+        self._markers = {text: k for k, text in enumerate(self.MARKERS)}
+        self._codes = {}
+        self._strings = []
+        self._overflow = {}  # (row, column) -> original text
+        self._extra = {}  # row -> fields beyond column_headers
+
+    def __len__(self):
+        return len(self.host_ns)
+
+    def _code(self, text):
+        code = self._codes.get(text)
+        if code is None:
+            code = len(self._strings)
+            if code >= self.CODE_MISSING:
+                return None
+            self._codes[text] = code
+            self._strings.append(text)
+        return code
+
+    def append(self, arrival, fields, device_time=None):
+        if len(self.host_ns) >= self.max_rows:
+            self._trim(self.max_rows // 2)
+        row = len(self.host_ns)
+        markers = self._markers
+        for j, (kind, values, decimals) in enumerate(self._columns):
+            text = fields[j] if j < len(fields) else ''
+            marker = markers.get(text)
+            if kind == 'f':
+                if marker is not None:
+                    values.append(math.nan)
+                    decimals.append(-2 - marker)
+                    continue
+                point = text.find('.')
+                places = len(text) - point - 1 if point >= 0 else -1
+                try:
+                    value = float(text)
+                    exact = 0 <= places < 127 and f"{value:.{places}f}" == text or places < 0 and str(int(value)) == text
+                except (ValueError, OverflowError):
+                    exact = False
+                if exact:
+                    values.append(value)
+                    decimals.append(places)
+                else:
+                    values.append(math.nan)
+                    decimals.append(-2 - len(self.MARKERS))
+                    self._overflow[(row, j)] = text
+            elif kind == 'i':
+                if marker is not None:
+                    values.append(self.INT_MARKER + marker)
+                    continue
+                try:
+                    value = int(text)
+                    exact = str(value) == text and self.INT_MISSING < value < 2 ** 31
+                except ValueError:
+                    exact = False
+                if exact:
+                    values.append(value)
+                else:
+                    values.append(self.INT_MISSING)
+                    self._overflow[(row, j)] = text
+            else:
+                code = self._code(text)
+                if code is None:
+                    values.append(self.CODE_MISSING)
+                    self._overflow[(row, j)] = text
+                else:
+                    values.append(code)
+        if len(fields) > len(self._columns):
+            self._extra[row] = list(fields[len(self._columns):])
+        self.device_s.append(math.nan if device_time is None else device_time)
+        self.appended += 1
+        # The timestamp goes in last: len() only counts rows whose columns are complete
+        self.host_ns.append(int(arrival * 1e9))
+
+    def _trim(self, count):
+        # Drop the oldest `count` rows; deleting half at a time keeps appends O(1) on average
+        del self.host_ns[:count]
+        del self.device_s[:count]
+        for _, values, decimals in self._columns:
+            del values[:count]
+            if decimals is not None:
+                del decimals[:count]
+        self._overflow = {(row - count, j): text for (row, j), text in self._overflow.items() if row >= count}
+        self._extra = {row - count: extra for row, extra in self._extra.items() if row >= count}
+
+    def _text(self, row, j):
+        kind, values, decimals = self._columns[j]
+        value = values[row]
+        if kind == 'f':
+            places = decimals[row]
+            if places >= -1:
+                return f"{value:.{places}f}" if places >= 0 else str(int(value))
+            marker = -2 - places
+            return self.MARKERS[marker] if marker < len(self.MARKERS) else self._overflow[(row, j)]
+        if kind == 'i':
+            if value >= self.INT_MISSING + 1:
+                return str(value)
+            return self._overflow[(row, j)] if value == self.INT_MISSING else self.MARKERS[value - self.INT_MARKER]
+        return self._overflow[(row, j)] if value == self.CODE_MISSING else self._strings[value]
+
+    def device_time(self, row):
+        value = self.device_s[row]
+        return None if math.isnan(value) else value
+
+    def value(self, row, name):
+        # Typed value of one cell (float, int or str); cells without a value give their text
+        j = self._index[name]
+        kind, values, decimals = self._columns[j]
+        if kind == 'c' or kind == 'f' and decimals[row] < -1 or kind == 'i' and values[row] <= self.INT_MISSING:
+            return self._text(row, j)
+        return values[row]
+
+    def row(self, row):
+        fields = [self._text(row, j) for j in range(len(self._columns))]
+        fields.extend(self._extra.get(row, ()))
+        return [format_host_time(self.host_ns[row] / 1e9)] + fields
+
+    def rows(self, start=0, stop=None):
+        for row in range(start, len(self) if stop is None else stop):
+            yield self.row(row)
+
+    def nbytes(self):
+        total = (self.host_ns.itemsize + self.device_s.itemsize) * len(self.host_ns)
+        for _, values, decimals in self._columns:
+            total += values.itemsize * len(values)
+            if decimals is not None:
+                total += decimals.itemsize * len(decimals)
+        return total
+
+
+class DeviceJournal:
+    """
+    Write-ahead journal of one device's rows for the current session, in the same CSV
+    layout as the exported data file. Every row is flushed to the OS as it arrives (so a
+    crash of RTFED loses nothing); fsync_policy decides how often it is forced to disk to
+    survive a power cut: "row" (every row), "rows" (every fsync_rows rows) or "interval"
+    (every fsync_interval_ms, also checked from the reactor tick when a device is quiet).
+    """
+    FSYNC_POLICIES = ("row", "rows", "interval")
+
+    def __init__(self, path, fsync_policy="interval", fsync_interval_ms=1000, fsync_rows=100):
+        if fsync_policy not in self.FSYNC_POLICIES:
+            raise ValueError(f"Unknown journal fsync policy {fsync_policy!r}; "
+                             f"use one of {', '.join(self.FSYNC_POLICIES)}")
+        self.path = path
+        self.fsync_policy = fsync_policy
+        self.fsync_interval = fsync_interval_ms / 1000.0
+        self.fsync_rows = fsync_rows
+        is_new = not os.path.exists(path) or os.path.getsize(path) == 0
+        self._file = open(path, "a", newline="")
+        self._writer = csv.writer(self._file)
+        if is_new:
+            self._writer.writerow(column_headers)
+            self._file.flush()
+        self.rows = 0
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+
+    def append(self, row):
+        self._writer.writerow(row)
+        self._file.flush()
+        self.rows += 1
+        self._unsynced += 1
+        if self.fsync_policy == "row" or (self.fsync_policy == "rows" and self._unsynced >= self.fsync_rows):
+            self.sync()
+        elif self.fsync_policy == "interval":
+            self.sync_if_due()
+
+    def sync_if_due(self, now=None):
+        if self._unsynced and self.fsync_policy == "interval":
+            if (now or time.monotonic()) - self._last_sync >= self.fsync_interval:
+                self.sync()
+
+    def sync(self):
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+
+    def close(self):
+        if not self._file.closed:
+            self.sync()
+            self._file.close()
+
+    def export(self, destination):
+        # Streams the journal into the data file; memory use doesn't depend on session length
+        self.close()
+        with open(self.path, "rb") as src, open(destination, "wb") as dst:
+            shutil.copyfileobj(src, dst, 1 << 20)
+
+
+def make_marker_row(device_number, timestamp, event):
+    # Host-generated row with only the time, device and event filled in
+    row = [''] * len(column_headers)
+    row[0] = format_host_time(timestamp)
+    row[column_headers.index("Event")] = event
+    row[column_headers.index("Device_Number")] = device_number
+    return row
+
+def make_jam_row(device_number, timestamp):
+    # Alert row picked up by the Apps Script e-mail trigger
+    return make_marker_row(device_number, timestamp, "JAM")
+
+
+class DeviceOutbox:
+    """
+    Append-only upload queue for one worksheet, kept on disk next to a committed-offset
+    marker. Each record is a CSV line prefixed with its kind (R = data row, J = JAM alert).
+    The uploader reads from the committed offset and moves it forward only after Google
+    accepted the rows, so nothing is lost across crashes and restarts and RAM use stays
+    flat however long the network is down. A crash between a successful upload and its
+    commit sends that one batch again on the next start.
+    """
+    ROW = "R"
+    JAM = "J"
+
+    def __init__(self, directory, title, label=None, compact_bytes=1 << 20, log_queue=None):
+        self.title = title
+        self.label = label or title
+        self.compact_bytes = compact_bytes
+        self.log_queue = log_queue
+        self.path = os.path.join(directory, f"{title}.outbox")
+        self.offset_path = self.path + ".offset"
+        self._lock = threading.Lock()
+        self._file = open(self.path, "ab")
+        self.size = os.path.getsize(self.path)
+        self.committed = min(self._load_offset(), self.size)
+
+    def _load_offset(self):
+        try:
+            with open(self.offset_path, "r") as f:
+                text = f.read().strip()
+        except FileNotFoundError:
+            return 0
+        except OSError as e:
+            text = f"<{e}>"
+        try:
+            return int(text)
+        except ValueError:
+            # Starting over from 0 would send every row in the outbox again; skip them
+            # instead, they are all in the session journal
+            if self.log_queue is not None:
+                self.log_queue.put(
+                    f"Upload marker {self.offset_path} is unreadable ({text!r}); the "
+                    f"{self.size / 1024:.1f} KB already in the {self.title} outbox are treated as sent. "
+                    f"Check that sheet against the local data files.")
+            return self.size
+
+    def _store_offset(self):
+        # The rows and the new marker reach the disk before the marker is swapped in, so a
+        # power cut leaves either the old marker or the new one, never an empty file
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        tmp_path = self.offset_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            f.write(str(self.committed))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.offset_path)
+
+    def append(self, kind, row):
+        text = io.StringIO()
+        csv.writer(text, lineterminator="\n").writerow([kind] + list(row))
+        data = text.getvalue().encode("utf-8")
+        with self._lock:
+            self._file.write(data)
+            self._file.flush()
+            self.size += len(data)
+
+    def pending_bytes(self):
+        return self.size - self.committed
+
+    def peek(self, max_records):
+        # Returns up to max_records (kind, row) pairs after the committed offset and the
+        # offset to commit once they are uploaded.
+        with self._lock:
+            start, end = self.committed, self.size
+        records = []
+        if start >= end:
+            return records, start
+        position = start
+        with open(self.path, "rb") as f:
+            f.seek(start)
+            while position < end and len(records) < max_records:
+                raw = f.readline()
+                if not raw.endswith(b"\n"):
+                    break
+                position += len(raw)
+                fields = next(csv.reader([raw.decode("utf-8", errors="replace")]), None)
+                if fields:
+                    records.append((fields[0], fields[1:]))
+        return records, position
+
+    def commit(self, offset):
+        with self._lock:
+            self.committed = offset
+            if self.committed >= self.size and self.size >= self.compact_bytes:
+                # Everything is uploaded: start the file over. Truncate before storing the
+                # offset so a crash in between can't make old rows look unsent.
+                self._file.truncate(0)
+                self.size = 0
+                self.committed = 0
+            self._store_offset()
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+class SheetsUploader:
+    """
+    Background stage between the serial readers and Google Sheets. Readers append rows to
+    a per-worksheet DeviceOutbox on disk; this thread drains the outboxes every
+    send_interval and writes every device's rows with a single spreadsheets.batchUpdate
+    request, one appendCells per worksheet. A batch is applied atomically and offsets are
+    only committed after it succeeds, so a failed flush is simply retried next round. A batch
+    Google rejects outright (e.g. a Device_N sheet was deleted) is retried with fresh
+    worksheets and then split per worksheet, so one bad sheet can't stop the whole fleet.
+    """
+    def __init__(self, gspread_client, spreadsheet_id, log_queue, send_interval=5,
+                 max_batch_rows=5000, limiter=None, outbox_dir=None):
+        self.gspread_client = gspread_client
+        self.spreadsheet_id = spreadsheet_id
+        self.log_queue = log_queue
+        self.limiter = limiter or GoogleApiLimiter(log_queue)
+        self.send_interval = send_interval
+        self.max_batch_rows = max_batch_rows
+        safe_id = re.sub(r'[^A-Za-z0-9_-]', '_', spreadsheet_id)
+        self.outbox_dir = outbox_dir or os.path.join(RTFED_HOME, "outbox", safe_id)
+        os.makedirs(self.outbox_dir, exist_ok=True)
+        self.stats = StageTimer()
+        self._spreadsheet = None
+        self._sheets = {}  # worksheet name -> gspread Worksheet
+        self._outboxes = {}  # worksheet name -> DeviceOutbox
+        self._outboxes_lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread = None
+        self._restore_outboxes()
+
+    def _restore_outboxes(self):
+        for name in sorted(os.listdir(self.outbox_dir)):
+            if not name.endswith(".outbox"):
+                continue
+            outbox = DeviceOutbox(self.outbox_dir, name[:-len(".outbox")], log_queue=self.log_queue)
+            self._outboxes[outbox.title] = outbox
+            if outbox.pending_bytes():
+                self.log_queue.put(
+                    f"Resuming upload of {outbox.pending_bytes() / 1024:.1f} KB left unsent for "
+                    f"{outbox.title} by a previous session.")
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="rtfed-sheets-uploader", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=30):
+        # One last flush runs before the thread exits; don't hang STOP on a dead network.
+        # Whatever is left stays in the outboxes for the next session.
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def _outbox(self, pipeline):
+        outbox = self._outboxes.get(pipeline.worksheet_name)
+        if outbox is None:
+            with self._outboxes_lock:
+                outbox = self._outboxes.get(pipeline.worksheet_name)
+                if outbox is None:
+                    outbox = DeviceOutbox(self.outbox_dir, pipeline.worksheet_name, log_queue=self.log_queue)
+                    self._outboxes[pipeline.worksheet_name] = outbox
+        outbox.label = pipeline.port
+        return outbox
+
+    def enqueue_row(self, pipeline, row):
+        try:
+            self._outbox(pipeline).append(DeviceOutbox.ROW, row)
+        except OSError as e:
+            self.log_queue.put(f"Could not queue row from {pipeline.port} for Google Sheets (still saved locally): {e}")
+
+    def enqueue_jam(self, pipeline):
+        try:
+            self._outbox(pipeline).append(DeviceOutbox.JAM, make_jam_row(pipeline.device_number, time.time()))
+        except OSError as e:
+            self.log_queue.put(f"Could not queue JAM alert for {pipeline.port}: {e}")
+
+    def pending_bytes(self):
+        return sum(outbox.pending_bytes() for outbox in list(self._outboxes.values()))
+
+    def _run(self):
+        while True:
+            stopping = self._stop_event.wait(self.send_interval)
+            self.flush()
+            if stopping:
+                break
+        for outbox in list(self._outboxes.values()):
+            outbox.close()
+
+    def _timed(self, call, *args, items=1):
+        # Includes time spent waiting on the limiter, which is part of the uploader's latency
+        started = time.perf_counter()
+        try:
+            return call(*args)
+        finally:
+            self.stats.add(time.perf_counter() - started, items)
+
+    def _worksheet(self, title, port):
+        sheet = self._sheets.get(title)
+        if sheet is None:
+            try:
+                if self._spreadsheet is None:
+                    self._spreadsheet = self._timed(
+                        self.limiter.call, "read", self.gspread_client.open_by_key, self.spreadsheet_id, items=0)
+                    # One metadata call for every existing Device_N sheet instead of one per device
+                    for ws in self._timed(self.limiter.call, "read", self._spreadsheet.worksheets, items=0):
+                        self._sheets.setdefault(ws.title, ws)
+                    sheet = self._sheets.get(title)
+                if sheet is None:
+                    sheet = self._timed(get_or_create_worksheet, self._spreadsheet, title, self.limiter, items=0)
+            except Exception as e:
+                self.log_queue.put(f"Failed to access sheet {title} for {port}: {e}")
+                return None
+            self._sheets[title] = sheet
+        return sheet
+
+    def _build_batch(self):
+        requests = []
+        taken = []  # (outbox, offset to commit, data rows, JAM alerts) once the batch succeeds
+        budget = self.max_batch_rows
+        for title, outbox in list(self._outboxes.items()):
+            if budget <= 0:
+                break
+            if not outbox.pending_bytes():
+                continue
+            sheet = self._worksheet(title, outbox.label)
+            if sheet is None:
+                continue
+            records, offset = outbox.peek(budget)
+            if not records:
+                continue
+            rows = []
+            jams = 0
+            for kind, row in records:
+                if kind == DeviceOutbox.JAM:
+                    # One alert per batch is enough to trigger the e-mail
+                    jams += 1
+                    if jams > 1:
+                        continue
+                rows.append(row)
+            requests.append(append_cells_request(sheet.id, rows))
+            taken.append((outbox, offset, len(records) - jams, jams))
+            budget -= len(records)
+        return requests, taken
+
+    def _send(self, requests, taken):
+        # Raises if the batch failed; nothing is committed then
+        row_count = sum(count for _, _, count, _ in taken)
+        self._timed(self.limiter.call, "write", self._spreadsheet.batch_update,
+                    {"requests": requests}, items=row_count)
+        for outbox, offset, count, jams in taken:
+            outbox.commit(offset)
+            if jams:
+                self.log_queue.put(f"JAM event logged for {outbox.label}")
+        self.log_queue.put(f"Appended {row_count} rows from {len(taken)} devices to Google Sheets in one request.")
+
+    def flush(self):
+        while True:
+            requests, taken = self._build_batch()
+            if not requests:
+                return
+            try:
+                self._send(requests, taken)
+            except Exception as e:
+                row_count = sum(count for _, _, count, _ in taken)
+                self.log_queue.put(f"Failed to send data to Google Sheets ({row_count} rows from {len(taken)} devices): {e}")
+                status = api_error_status(e)
+                if status is not None and not is_transient_status(status):
+                    self._resend_rejected()
+                return
+            if not any(outbox.pending_bytes() for outbox, _, _, _ in taken):
+                return
+
+    def _resend_rejected(self):
+        # A rejected batch (400, ...) usually means a cached worksheet was deleted or changed:
+        # look every sheet up again (recreating missing ones) and retry, then send one
+        # worksheet at a time so a sheet that is still rejected can't hold up the others
+        self._spreadsheet = None
+        self._sheets = {}
+        requests, taken = self._build_batch()
+        if not requests:
+            return
+        try:
+            self._send(requests, taken)
+            return
+        except Exception as e:
+            status = api_error_status(e)
+            if status is None or is_transient_status(status):
+                self.log_queue.put(f"Failed to send data to Google Sheets: {e}")
+                return
+            self.log_queue.put("Google Sheets still rejects the batch; sending each device's rows separately.")
+        for request, item in zip(requests, taken):
+            outbox = item[0]
+            try:
+                self._send([request], [item])
+            except Exception as e:
+                self.log_queue.put(f"Google Sheets rejected the rows for {outbox.title} ({outbox.label}); "
+                                   f"they stay queued: {e}")
+
+
+class FED3Monitor:
+    """
+    The acquisition engine behind both the Tk GUI and the headless daemon: follows FED3s
+    as they are plugged in, identifies them, logs their rows to local journals and Google
+    Sheets, keeps their clocks in line and runs SET_MODE/TRIGGER_POKE/SET_TIME commands.
+    Messages for the user go to log_queue. A client overrides the hook methods
+    (port_attached, port_detached, set_port_status, report_stall) to show what happens,
+    and calls service() periodically.
+    """
+    def __init__(self):
+        self.log_queue = queue.Queue()
+        self.experimenter = ""
+        self.experiment = ""
+        self.credentials_file = ""
+        self.spreadsheet_key = ""
+        self.save_path = ""
+        # Filled in by the hotplug monitor thread; clients never enumerate or open ports
+        self.serial_ports = set()
+        self.hotplug = None
+        # Known FED3s by USB serial number; ports mapped from it are verified by their first row
+        self.registry = DeviceRegistry(os.path.join(RTFED_HOME, "devices.json"), self.log_queue)
+        self.unverified_ports = set()
+        # Messages for each port's panel ("Data logged", "RIGHT_POKE"); only ports a client
+        # shows get a queue
+        self.port_queues = {}
+        self.port_pipelines = {}
+        self.port_status = {}
+        # Per-port write-ahead journals of the running session (see DeviceJournal)
+        self.journals = {}
+        # Compact in-memory copy of the recent part of each device's session, used for the
+        # port summaries
+        self.row_stores = {}
+        # Per-port fit of the FED3 clock against host time; devices that drift further than
+        # drift_threshold seconds are resynced on their own. Every estimate and resync goes
+        # to the session's clock drift log.
+        self.drift_trackers = {}
+        self.drift_threshold = 0.5
+        self.drift_min_samples = 30
+        self.drift_check_interval = 60
+        self.last_drift_check_time = time.time()
+        self.drift_log_lock = threading.Lock()
+        self.alert_log_lock = threading.Lock()
+        # A logging port silent this long is probed, and reopened if the probe gets no answer
+        self.stall_quiet_timeout = 300
+        self.stall_probe_timeout = 10
+        self.journal_dir = None
+        self.journal_dir_lock = threading.Lock()
+        self.journal_fsync_policy = "interval"
+        self.journal_fsync_interval_ms = 1000
+        self.journal_fsync_rows = 100
+        self.stop_event = threading.Event()
+        self.logging_active = False
+        self.data_saved = False
+        self.gspread_client = None
+        # Reopen delays for logging ports (first, backoff factor, max), retried while logging
+        self.reconnect_delays = (0.1, 2.0, 5.0)
+        self.port_to_device_number = {}
+        # ClockSync in progress, if any
+        self.clock_sync = None
+        # Ports with a SET_MODE run in progress, and that run's per-port status updates
+        self.mode_change_ports = set()
+        self.mode_progress_queue = queue.Queue()
+        self.restart_delay = 3
+        # One reactor thread reads every port; Google Sheets calls run on the uploader thread
+        self.reactor = SerialReactor(self.log_queue,
+                                     watchdog=StallWatchdog(self.stall_quiet_timeout, self.stall_probe_timeout))
+        self.reactor.start()
+        self.uploader = None
+        self.stats_interval = 60
+        self.last_stats_time = time.time()
+
+    def start(self):
+        # Separate from __init__ so a client can set itself up before the first port shows up
+        self.report_unfinished_journals()
+        self.hotplug = HotplugMonitor(self.log_queue, self.on_port_attached, self.on_port_detached)
+        self.hotplug.start()
+
+    def shutdown(self):
+        if self.hotplug is not None:
+            self.hotplug.stop()
+        self.reactor.stop()
+
+    def service(self, now):
+        # Periodic duties; clients call this a few times a second
+        if now - self.last_drift_check_time >= self.drift_check_interval:
+            if self.logging_active:
+                self.check_clock_drift()
+            self.last_drift_check_time = now
+        if now - self.last_stats_time >= self.stats_interval:
+            if self.logging_active:
+                self.log_pipeline_stats()
+            self.last_stats_time = now
+
+    # Client hooks
+
+    def port_attached(self, port, ready):
+        # Hotplug monitor thread; ready is None when the port's pipeline reports its status
+        if ready is not None:
+            self.set_port_status(port, "Ready" if ready else "Not Ready", "green" if ready else "red")
+        self.start_port_services(port)
+
+    def port_detached(self, port):
+        self.set_port_status(port, "Not Ready", "red")
+
+    def set_port_status(self, port, text, color):
+        # Any thread
+        self.port_status[port] = (text, color)
+
+    def report_stall(self, port, silent_for):
+        # Reactor thread; the reactor reopens the port right after this
+        message = f"Port {port} stopped delivering data ({silent_for:.0f} s silent, no reply to probe); reopening it."
+        self.log_queue.put(f"ALERT: {message}")
+        self.log_alert(port, "STALLED", message)
+
+    # Ports and devices
+
+    def on_port_attached(self, port):
+        # Hotplug monitor thread: probe here, not on a client's thread. A port that already
+        # has a pipeline is being reopened by the reactor, which reports its status; a
+        # second open here could race it (opens are exclusive on Windows).
+        if port in self.port_pipelines:
+            ready, error = None, None
+        else:
+            ready, error = probe_port(port)
+        if error is not None and "PermissionError" not in str(error):
+            self.log_queue.put(f"Error with port {port}: {error}")
+        entry = self.registry.lookup(self.hotplug.serial_number(port))
+        if entry and entry.get("device_number") and port not in self.port_to_device_number:
+            self.port_to_device_number[port] = entry["device_number"]
+            self.unverified_ports.add(port)
+            last_mode = entry.get("mode") or entry.get("session_type") or "unknown"
+            self.log_queue.put(f"Device_{entry['device_number']} on {port} from the device registry "
+                               f"(last mode {last_mode}); it is verified from its first data line.")
+        self.serial_ports.add(port)
+        self.port_attached(port, ready)
+
+    def on_port_detached(self, port):
+        # A logging port keeps its pipeline: the reactor reconnects it when the device is back
+        self.serial_ports.discard(port)
+        self.log_queue.put(f"Device on {port} disconnected.")
+        pipeline = self.port_pipelines.get(port)
+        if pipeline is not None and not pipeline.logging:
+            del self.port_pipelines[port]
+            self.reactor.close_port(port)
+        self.port_detached(port)
+
+    def start_port_services(self, port):
+        # Open the port (or bring a pending reconnect forward); a device already known,
+        # e.g. from the registry, starts logging straight away and is verified by its first row
+        self.watch_port(port)
+        if self.logging_active and port in self.port_to_device_number:
+            self.start_logging_for_port(port)
+
+    def watch_port(self, port):
+        # One connection per port for its whole life: identification, commands and logging
+        if port in self.port_pipelines:
+            self.reactor.retry_now(port)
+            return
+        pipeline = DevicePipeline(self, port, reconnect=self.reconnect_delays)
+        self.port_pipelines[port] = pipeline
+        delay, backoff, max_delay = self.reconnect_delays
+        self.reactor.open_port(port, pipeline, retries=None, delay=delay, backoff=backoff, max_delay=max_delay)
+
+    def port_channels(self):
+        # Command channels of every watched port, so commands share its reader connection
+        return {port: pipeline.channel for port, pipeline in list(self.port_pipelines.items())}
+
+    def confirm_device(self, port, device_number, session_type=None):
+        # Called from the reactor thread with the first data row of each connection
+        known = self.port_to_device_number.get(port)
+        if known != device_number:
+            self.port_to_device_number[port] = device_number
+        if known is None:
+            self.log_queue.put(f"Identified device_number={device_number} on port={port}")
+        if port in self.unverified_ports:
+            self.unverified_ports.discard(port)
+            self.log_queue.put(f"Verified device_number={device_number} on port={port}")
+        self.registry.remember(self.hotplug.serial_number(port), device_number=device_number,
+                               session_type=session_type, port=port)
+        if self.logging_active:
+            self.start_logging_for_port(port)
+
+    def register_device_number(self, port, device_number):
+        self.port_to_device_number[port] = device_number
+        self.unverified_ports.discard(port)
+        self.registry.remember(self.hotplug.serial_number(port), device_number=device_number, port=port)
+        if self.logging_active:
+            self.start_logging_for_port(port)
+
+    def identify_devices(self):
+        # Poke every connected FED3 so it reports its device number
+        self.log_queue.put("Identifying devices by triggering a poke on all connected FED3 devices...")
+        threading.Thread(target=self.trigger_poke_for_identification, daemon=True).start()
+
+    def needs_poke(self, port):
+        # TRIGGER_POKE makes the firmware log a simulated poke, which lands in the device's
+        # counters, the journal and Sheets; only devices nobody knows yet are poked
+        pipeline = self.port_pipelines.get(port)
+        return port not in self.port_to_device_number and not (pipeline is not None and pipeline.logging)
+
+    def trigger_poke_for_identification(self):
+        connected = list(self.serial_ports)
+        if not connected:
+            self.log_queue.put("No FED3 devices detected.")
+            return
+        active_ports = [port for port in connected if self.needs_poke(port)]
+        for port in connected:
+            if port not in active_ports:
+                device_number = self.port_to_device_number.get(port) or self.port_pipelines[port].device_number
+                self.log_queue.put(f"Device_{device_number} on {port} is already identified; not poked.")
+        if not active_ports:
+            self.log_queue.put("All connected FED3 devices are already identified.")
+            return
+        self.log_queue.put("Triggering poke on the unidentified FED3 devices for identification...")
+        parser = FED3Parser()
+
+        def match(port, line):
+            self.log_queue.put(f"Received from {port}: {line}")
+            record = parser.parse(line)
+            if record is not None and record.device_number:
+                return record.device_number
+            return None
+
+        def identified(port, device_number, latency):
+            self.register_device_number(port, device_number)
+            self.log_queue.put(f"Identified device_number={device_number} on port={port} "
+                               f"in {latency * 1000:.0f} ms")
+
+        started = time.time()
+        # Every port gets the poke at once; 3 s is the deadline for the whole fleet
+        # The poke's data row is only observed, so it also reaches the port's pipeline
+        query = FleetQuery(self.log_queue, b'TRIGGER_POKE\n', match, timeout=3.0, on_result=identified,
+                           channels=self.port_channels(), consume=False)
+        replies = query.run(active_ports)
+        for port in active_ports:
+            if port not in replies:
+                self.log_queue.put(f"No valid device number received from {port}.")
+        slowest = max((latency for _, latency in replies.values()), default=0.0)
+        self.log_queue.put(f"Identification process complete: {len(replies)}/{len(active_ports)} devices "
+                           f"answered in {time.time() - started:.1f} s (slowest reply {slowest * 1000:.0f} ms).")
+
+    # Mode changes
+
+    def change_mode(self, mode_num, ports):
+        # False if a mode change is still running on any of the ports
+        if any(port in self.mode_change_ports for port in ports):
+            return False
+        self.mode_change_ports.update(ports)
+        self.log_queue.put(f"Sending mode {mode_num} to {len(ports)} devices...")
+        threading.Thread(target=self.mode_change_worker, args=(mode_num, ports), daemon=True).start()
+        return True
+
+    def mode_change_worker(self, mode_num, ports):
+        def progress(port, status):
+            self.mode_progress_queue.put((port, status))
+
+        def match(port, line):
+            return line if line in ("MODE_SET_OK", "MODE_SET_FAIL") else None
+
+        def answered(port, reply, latency):
+            if reply == "MODE_SET_OK":
+                self.log_queue.put(f"Mode {mode_num} set on {port} in {latency * 1000:.0f} ms. Device will restart.")
+                mode_label = MODE_OPTIONS[mode_num] if mode_num < len(MODE_OPTIONS) else str(mode_num)
+                self.registry.remember(self.hotplug.serial_number(port), mode=mode_label)
+                progress(port, "Confirmed, restarting")
+            else:
+                self.log_queue.put(f"Mode set failed on {port}.")
+                progress(port, "Failed")
+
+        try:
+            for port in ports:
+                progress(port, "Sending")
+            query = FleetQuery(self.log_queue, f"SET_MODE:{mode_num}\n", match, timeout=3.0, on_result=answered,
+                               channels=self.port_channels())
+            replies = query.run(ports)
+            for port in ports:
+                if port not in replies:
+                    self.log_queue.put(f"No confirmation received from {port} when setting mode.")
+                    progress(port, "No confirmation")
+            restarting = [port for port, (reply, _) in replies.items() if reply == "MODE_SET_OK"]
+            self.reidentify_after_restart(restarting, progress)
+        finally:
+            self.mode_change_ports.difference_update(ports)
+
+    def reidentify_after_restart(self, ports, progress, timeout=30):
+        # The firmware restarts after MODE_SET_OK; poke each device again once its port is
+        # back so the port -> device number mapping is current without pressing Identify.
+        # Devices that are already known or logging are not poked (see needs_poke): their
+        # pipeline re-checks the device number from the first row after the restart instead.
+        pending = set()
+        for port in ports:
+            pipeline = self.port_pipelines.get(port)
+            if not self.needs_poke(port):
+                if pipeline is not None:
+                    pipeline.check_next_row = True
+                self.unverified_ports.add(port)
+                progress(port, "Restarting, verified from its first row")
+            else:
+                pending.add(port)
+        if not pending:
+            return
+        parser = FED3Parser()
+
+        def match(port, line):
+            record = parser.parse(line)
+            if record is not None and record.device_number:
+                return record.device_number
+            return None
+
+        def identified(port, device_number, latency):
+            self.register_device_number(port, device_number)
+            self.log_queue.put(f"Identified device_number={device_number} on port={port} after restart")
+            progress(port, f"Done, device {device_number}")
+
+        deadline = time.time() + timeout
+        time.sleep(self.restart_delay)
+        while pending and time.time() < deadline:
+            present = pending.intersection(self.hotplug.ports())
+            if present:
+                replies = FleetQuery(self.log_queue, b'TRIGGER_POKE\n', match, timeout=3.0, on_result=identified,
+                                     channels=self.port_channels(), consume=False).run(present)
+                pending.difference_update(replies)
+            if pending:
+                time.sleep(2)
+        for port in pending:
+            self.log_queue.put(f"Device on {port} did not answer after restarting; press Identify Devices.")
+            progress(port, "Not identified after restart")
+
+    # Logging session
+
+    def connect_sheets(self):
+        # Raises if the credentials are unusable; the uploader is kept across restarts of logging.
+        # The Google client libraries take longer to import than the rest of RTFED put
+        # together, so they are only loaded here, when a session first needs Sheets.
+        import gspread
+        from google.oauth2.service_account import Credentials
+        creds = Credentials.from_service_account_file(self.credentials_file, scopes=SCOPE)
+        self.gspread_client = gspread.authorize(creds)
+        self.log_queue.put("Connected to Google Sheets!")
+        if self.uploader is None:
+            self.uploader = SheetsUploader(self.gspread_client, self.spreadsheet_key, self.log_queue)
+            self.uploader.start()
+
+    def start_logging(self):
+        # Raises (with logging left off) if the settings are invalid or Google Sheets cannot
+        # be reached
+        if self.journal_fsync_policy not in DeviceJournal.FSYNC_POLICIES:
+            raise ValueError(f"Unknown journal_fsync_policy {self.journal_fsync_policy!r}; "
+                             f"use one of {', '.join(DeviceJournal.FSYNC_POLICIES)}")
+        self.experimenter = re.sub(r'[<>:"/\\|?*]', '_', self.experimenter.strip().lower())
+        self.experiment = re.sub(r'[<>:"/\\|?*]', '_', self.experiment.strip().lower())
+        if self.uploader is None:
+            self.connect_sheets()
+        # The reactor thread starts journaling as soon as logging_active is set, so the
+        # session directory has to exist first
+        self.ensure_journal_dir()
+        self.stop_event.clear()
+        self.logging_active = True
+        for port in list(self.serial_ports):
+            if port in self.port_to_device_number:
+                self.start_logging_for_port(port)
+
+    def start_logging_for_port(self, port):
+        pipeline = self.port_pipelines.get(port)
+        if pipeline is None or pipeline.logging:
+            return
+        if port not in self.port_to_device_number:
+            self.log_queue.put(f"Cannot start logging for {port}, no device_number known yet.")
+            return
+        pipeline.begin_logging()
+
+    def finish_session(self):
+        # Blocks until every port is closed, the outboxes are flushed and the data is exported
+        self.stop_event.set()
+        self.logging_active = False
+        self.reactor.close_all()
+        for port, pipeline in self.port_pipelines.items():
+            if pipeline.logging:
+                self.log_queue.put(f"Closed serial port {port}")
+        if self.uploader is not None:
+            self.uploader.stop()
+        self.log_queue.put("Logging stopped.")
+        self.save_all_data()
+        self.data_saved = True
+
+    def ensure_journal_dir(self):
+        # Called from the client thread and the reactor thread; journal_dir is only set
+        # once the directory exists
+        with self.journal_dir_lock:
+            if self.journal_dir is None:
+                experimenter_name = self.experimenter.strip().lower()
+                experiment_name = self.experiment.strip().lower()
+                session_name = f"{experimenter_name}_{experiment_name}_{datetime.datetime.now().strftime('%Y_%m_%d_%H_%M_%S')}"
+                journal_dir = os.path.join(RTFED_HOME, "journal", session_name)
+                os.makedirs(journal_dir, exist_ok=True)
+                self.journal_dir = journal_dir
+                self.log_queue.put(f"Session journal: {self.journal_dir}")
+            return self.journal_dir
+
+    def journal_for(self, port):
+        # Reconnects of the same device keep appending to the same journal
+        journal = self.journals.get(port)
+        if journal is None:
+            self.ensure_journal_dir()
+            device_number = self.port_to_device_number.get(port, "unknown")
+            safe_port_name = re.sub(r'[<>:"/\\|?*]', '_', os.path.basename(port))
+            path = os.path.join(self.journal_dir, f"{safe_port_name}_device_{device_number}.csv")
+            journal = DeviceJournal(path, self.journal_fsync_policy,
+                                    self.journal_fsync_interval_ms, self.journal_fsync_rows)
+            self.journals[port] = journal
+        return journal
+
+    def row_store_for(self, port):
+        store = self.row_stores.get(port)
+        if store is None:
+            store = self.row_stores[port] = DeviceRowStore()
+        return store
+
+    def drift_tracker_for(self, port):
+        tracker = self.drift_trackers.get(port)
+        if tracker is None:
+            tracker = self.drift_trackers[port] = ClockDriftTracker()
+        return tracker
+
+    def port_summary(self, port, now, rate=None):
+        # One line about a logged device, or None before its first row
+        store = self.row_stores.get(port)
+        if store is None or not len(store):
+            return None
+        last = len(store) - 1
+        text = (f"Port {port} | Device {store.value(last, 'Device_Number')} | {store.appended} events, "
+                f"{store.value(last, 'Pellet_Count')} pellets, {store.value(last, 'Battery_Voltage')} V")
+        if rate is not None:
+            text += f", {rate:.1f} rows/s"
+        estimate = self.drift_trackers[port].estimate(now) if port in self.drift_trackers else None
+        if estimate is not None:
+            offset, drift_ppm, _ = estimate
+            text += f" | clock {offset:+.1f} s" + (f", {drift_ppm:+.0f} ppm" if drift_ppm is not None else "")
+        pipeline = self.port_pipelines.get(port)
+        if pipeline is not None and pipeline.last_event_time is not None:
+            text += f" | last event {(now - pipeline.last_event_time) / 60:.0f} min ago"
+            if pipeline.stalls:
+                text += f", {pipeline.stalls} stalls"
+        return text
+
+    def log_alert(self, port, alert, detail):
+        # Local record of alerts, exported with the session data
+        if not self.journal_dir:
+            return
+        path = os.path.join(self.journal_dir, "alerts.csv")
+        with self.alert_log_lock:
+            is_new = not os.path.exists(path)
+            with open(path, "a", newline="") as f:
+                writer = csv.writer(f)
+                if is_new:
+                    writer.writerow(["Host_Time", "Port", "Device_Number", "Alert", "Detail"])
+                writer.writerow([format_host_time(time.time()), port,
+                                 self.port_to_device_number.get(port, "unknown"), alert, detail])
+
+    def log_drift(self, port, action, offset, drift_ppm=None, samples=0):
+        # Audit trail of clock estimates and resyncs, exported with the session data
+        if not self.journal_dir:
+            return
+        path = os.path.join(self.journal_dir, "clock_drift.csv")
+        with self.drift_log_lock:
+            is_new = not os.path.exists(path)
+            with open(path, "a", newline="") as f:
+                writer = csv.writer(f)
+                if is_new:
+                    writer.writerow(["Host_Time", "Port", "Device_Number", "Action", "Samples",
+                                     "Offset_ms", "Drift_ppm"])
+                writer.writerow([format_host_time(time.time()), port, self.port_to_device_number.get(port, "unknown"),
+                                 action, samples, f"{offset * 1000:.1f}",
+                                 "" if drift_ppm is None else f"{drift_ppm:.1f}"])
+
+    def check_clock_drift(self):
+        now = time.time()
+        drifted = []
+        for port, tracker in list(self.drift_trackers.items()):
+            estimate = tracker.estimate(now)
+            if estimate is None:
+                continue
+            offset, drift_ppm, samples = estimate
+            self.log_drift(port, "estimate", offset, drift_ppm, samples)
+            if samples >= self.drift_min_samples and abs(offset) > self.drift_threshold:
+                self.log_queue.put(f"Clock of device on {port} is off by {offset:+.2f} s; resyncing it.")
+                self.log_drift(port, "resync", offset, drift_ppm, samples)
+                drifted.append(port)
+        if drifted:
+            self.sync_device_times(drifted)
+
+    def sync_all_device_times(self):
+        self.sync_device_times(list(self.port_to_device_number))
+
+    def sync_device_times(self, ports):
+        if self.clock_sync is not None:
+            self.log_queue.put("Time sync already in progress.")
+            return
+        self.clock_sync = ClockSync(self.log_queue)
+        threading.Thread(target=self.clock_sync_worker, args=(self.clock_sync, ports), daemon=True).start()
+
+    def clock_sync_worker(self, sync, ports):
+        try:
+            with PortChannels(self.log_queue, ports, self.port_channels()) as channels:
+                offsets = sync.run(channels)
+            # The clock jumped, so the drift fit starts over from the new setting
+            for port, offset in offsets.items():
+                self.drift_tracker_for(port).reset()
+                self.log_drift(port, "synced", offset)
+        except Exception as e:
+            self.log_queue.put(f"Time sync failed: {e}")
+        finally:
+            self.clock_sync = None
+
+    def report_unfinished_journals(self):
+        journal_root = os.path.join(RTFED_HOME, "journal")
+        if not os.path.isdir(journal_root):
+            return
+        for name in sorted(os.listdir(journal_root)):
+            session_dir = os.path.join(journal_root, name)
+            if os.path.isdir(session_dir) and not os.path.exists(os.path.join(session_dir, "EXPORTED")):
+                self.log_queue.put(f"Found data from an unfinished session (not exported) in {session_dir}")
+
+    def save_all_data(self):
+        for journal in self.journals.values():
+            journal.close()
+        if not self.save_path:
+            self.log_queue.put("Error: No save path specified.")
+            if self.journal_dir:
+                self.log_queue.put(f"Session data is kept in {self.journal_dir}")
+            return
+        current_time = datetime.datetime.now().strftime("%Y_%m_%d_%H_%M_%S")
+        experimenter_name = self.experimenter.lower().strip()
+        experiment_name = self.experiment.lower().strip()
+        experimenter_folder = os.path.join(self.save_path, experimenter_name)
+        experiment_folder = os.path.join(experimenter_folder, f"{experiment_name}_{current_time}")
+        os.makedirs(experiment_folder, exist_ok=True)
+        saved_all = True
+        for port, journal in self.journals.items():
+            device_number = self.port_to_device_number.get(port, "unknown")
+            safe_port_name = re.sub(r'[<>:"/\\|?*]', '_', os.path.basename(port))
+            filename_user = os.path.join(experiment_folder, f"{safe_port_name}_device_{device_number}_{current_time}.csv")
+            try:
+                journal.export(filename_user)
+                self.log_queue.put(f"Data saved for {port} at {filename_user}.")
+            except Exception as e:
+                saved_all = False
+                self.log_queue.put(f"Failed to save data for {port}: {e}")
+        for name, lock in (("clock_drift", self.drift_log_lock), ("alerts", self.alert_log_lock)):
+            session_log = os.path.join(self.journal_dir, f"{name}.csv") if self.journal_dir else None
+            if session_log and os.path.exists(session_log):
+                with lock:
+                    shutil.copyfile(session_log, os.path.join(experiment_folder, f"{name}_{current_time}.csv"))
+        if saved_all and self.journal_dir:
+            open(os.path.join(self.journal_dir, "EXPORTED"), "w").close()
+
+    def log_pipeline_stats(self):
+        # Reader and uploader run on separate threads; report where the time goes in each
+        self.log_queue.put(f"Serial reader: {self.reactor.stats.report('lines')}")
+        if self.uploader is not None:
+            self.log_queue.put(
+                f"Sheets uploader: {self.uploader.stats.report('rows')}, "
+                f"{self.uploader.pending_bytes() / 1024:.1f} KB waiting in outboxes")
+            self.log_queue.put(f"Google API: {self.uploader.limiter.status()}")
+
+
+# Headless daemon
+
+# Config file keys (JSON) and the FED3Monitor attributes they set
+CONFIG_KEYS = {
+    "experimenter": "experimenter",
+    "experiment": "experiment",
+    "credentials_file": "credentials_file",
+    "spreadsheet_id": "spreadsheet_key",
+    "save_path": "save_path",
+    "drift_threshold": "drift_threshold",
+    "drift_check_interval": "drift_check_interval",
+    "stall_quiet_timeout": "stall_quiet_timeout",
+    "stall_probe_timeout": "stall_probe_timeout",
+    "journal_fsync_policy": "journal_fsync_policy",
+    "journal_fsync_interval_ms": "journal_fsync_interval_ms",
+    "journal_fsync_rows": "journal_fsync_rows",
+    "stats_interval": "stats_interval",
+}
+
+
+def load_config(path):
+    with open(path, encoding="utf-8") as f:
+        config = json.load(f)
+    unknown = sorted(set(config) - set(CONFIG_KEYS) - {"identify", "sync_time"})
+    if unknown:
+        raise ValueError(f"Unknown keys in {path}: {', '.join(unknown)}")
+    policy = config.get("journal_fsync_policy", "interval")
+    if policy not in DeviceJournal.FSYNC_POLICIES:
+        raise ValueError(f"journal_fsync_policy in {path} is {policy!r}; "
+                         f"use one of {', '.join(DeviceJournal.FSYNC_POLICIES)}")
+    return config
+
+
+def run_headless(config, identify=False, sync_time=False, settle=3.0, out=sys.stdout):
+    """
+    Logs every FED3 that is (or gets) plugged in until SIGINT/SIGTERM, then exports the
+    session like STOP and SAVE in the GUI. Log messages go to `out`, one per line.
+    """
+    monitor = FED3Monitor()
+    for key, value in config.items():
+        if key in CONFIG_KEYS:
+            setattr(monitor, CONFIG_KEYS[key], value)
+    # The watchdog was built with the defaults
+    monitor.reactor.watchdog.quiet_timeout = monitor.stall_quiet_timeout
+    monitor.reactor.watchdog.probe_timeout = monitor.stall_probe_timeout
+    stopping = threading.Event()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(signum, lambda *_: stopping.set())
+
+    def drain_log():
+        while True:
+            try:
+                message = monitor.log_queue.get_nowait()
+            except queue.Empty:
+                break
+            print(f"{datetime.datetime.now()}: {message}", file=out, flush=True)
+
+    monitor.start()
+    if identify:
+        # Give the hotplug monitor a moment to report the ports that are already connected,
+        # then identify before logging starts, so the poke rows are not logged. Devices
+        # known from the registry or their own data are not poked (see needs_poke).
+        settled = time.time() + settle
+        while not stopping.is_set() and time.time() < settled:
+            drain_log()
+            stopping.wait(0.1)
+        if not stopping.is_set():
+            monitor.trigger_poke_for_identification()
+        drain_log()
+    try:
+        monitor.start_logging()
+    except Exception as e:
+        monitor.log_queue.put(f"Cannot start logging: {e}")
+        drain_log()
+        monitor.shutdown()
+        return 1
+    def prepare():
+        if not identify:
+            stopping.wait(settle)
+        if not stopping.is_set():
+            monitor.sync_all_device_times()
+
+    if sync_time:
+        threading.Thread(target=prepare, daemon=True).start()
+    while not stopping.is_set():
+        monitor.service(time.time())
+        drain_log()
+        stopping.wait(0.5)
+    monitor.log_queue.put("Stopping logging...")
+    monitor.finish_session()
+    monitor.shutdown()
+    drain_log()
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Log FED3 devices to local files and Google Sheets without a GUI.")
+    parser.add_argument("--config", help="JSON file with any of: " + ", ".join(CONFIG_KEYS))
+    parser.add_argument("--experimenter")
+    parser.add_argument("--experiment")
+    parser.add_argument("--credentials-file", help="Google service account JSON file")
+    parser.add_argument("--spreadsheet-id")
+    parser.add_argument("--save-path", help="folder the session is exported to on exit")
+    parser.add_argument("--identify", action="store_true", help="poke every unidentified device once before logging starts")
+    parser.add_argument("--sync-time", action="store_true", help="set every device's clock once at start")
+    args = parser.parse_args(argv)
+    try:
+        config = load_config(args.config) if args.config else {}
+    except (OSError, ValueError) as e:
+        parser.error(str(e))
+    for key in ("experimenter", "experiment", "credentials_file", "spreadsheet_id", "save_path"):
+        if getattr(args, key) is not None:
+            config[key] = getattr(args, key)
+    missing = [key for key in ("credentials_file", "spreadsheet_id") if not config.get(key)]
+    if missing:
+        parser.error("missing " + ", ".join(missing) + " (set in --config or on the command line)")
+    return run_headless(config, identify=args.identify or config.get("identify", False),
+                        sync_time=args.sync_time or config.get("sync_time", False))
+
+
+if __name__ == "__main__":
+    sys.exit(main())